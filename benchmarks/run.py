@@ -0,0 +1,214 @@
+"""
+Benchmarks of tinyschedule on synthetic populations of schedules in SQLite.
+
+    $ python benchmarks/run.py                          # 1k, 10k and 100k schedules
+    $ python benchmarks/run.py --sizes 1000 --output results.json
+    $ python benchmarks/run.py --compare benchmarks/baseline.json
+
+Timings are the best of ``--repeat`` runs. With ``--compare``, timings that
+got slower than the tolerance, query counts that went up and occurrence
+counts that changed are reported, and the exit status is 1.
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DATABASE_DIR = tempfile.mkdtemp(prefix='tinyschedule-benchmarks-')
+
+from django.conf import settings  # noqa: E402
+
+settings.configure(
+    DATABASES={
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(DATABASE_DIR, 'benchmarks.db'),
+        }
+    },
+    INSTALLED_APPS=[
+        'django.contrib.contenttypes',
+        'tinyschedule',
+    ],
+    # Measure the expansion itself, not the occurrence cache
+    TINYSCHEDULE_OCCURRENCE_CACHE_SIZE=0,
+)
+
+import django  # noqa: E402
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+from tinyschedule.models import Schedule, ScheduleRepeatType, WeekDay  # noqa: E402
+
+
+SIZES = (1000, 10000, 100000)
+WINDOWS = (1, 7, 31, 365)
+TODAY = datetime.date(2024, 3, 1)
+SAMPLE_SIZE = 1000
+# Deep, but within the calendar for a schedule every 3 years
+DEEP_INDEX = 1000
+
+
+def synthetic_schedule(rng):
+    """
+    A random schedule, with start dates up to 30 years back, so lookups have
+    to skip long histories.
+    """
+    start_date = TODAY - datetime.timedelta(days=rng.randrange(30 * 365))
+    fields = {
+        'start_date': start_date,
+        'repeat_every': rng.choice((1, 1, 1, 2, 3)),
+    }
+
+    kind = rng.random()
+    if kind < 0.05:
+        fields['repeat_type'] = ScheduleRepeatType.NONE
+    elif kind < 0.25:
+        fields['repeat_type'] = ScheduleRepeatType.DAILY
+    elif kind < 0.55:
+        fields['repeat_type'] = ScheduleRepeatType.WEEKLY
+        for weekday_slug in rng.sample([weekday_slug for weekday_slug, weekday_name in WeekDay.choices],
+                                       rng.randint(2, 5)):
+            fields[weekday_slug] = True
+    elif kind < 0.75:
+        # About one in ten falls on the 29th to 31st, which some months skip
+        fields['repeat_type'] = ScheduleRepeatType.MONTHLY
+    elif kind < 0.9:
+        fields['repeat_type'] = ScheduleRepeatType.MONTHLY
+        fields['monthly_is_based_on_weekday'] = True
+    else:
+        fields['repeat_type'] = ScheduleRepeatType.YEARLY
+        if rng.random() < 0.3:
+            fields['start_date'] = datetime.date(rng.choice((1996, 2000, 2004, 2008, 2012)), 2, 29)
+
+    end = rng.random()
+    if end < 0.25:
+        fields['end_date'] = fields['start_date'] + datetime.timedelta(days=rng.randrange(20 * 365))
+    elif end < 0.4:
+        fields['end_after_occurrences'] = rng.randint(1, 500)
+    elif end < 0.5:
+        fields['end_date'] = fields['start_date'] + datetime.timedelta(days=rng.randrange(20 * 365))
+        fields['end_after_occurrences'] = rng.randint(1, 500)
+
+    return Schedule(**fields)
+
+
+def populate(size, seed=42):
+    Schedule.objects.all().delete()
+    rng = random.Random(seed)
+    schedules = [synthetic_schedule(rng) for i in range(size)]
+    for schedule in schedules:
+        schedule.update_denormalized_fields()
+    Schedule.objects.bulk_create(schedules, batch_size=2000)
+
+
+def best_of(repeat, function):
+    timings = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def benchmark(size, repeat):
+    results = {}
+    sample = list(Schedule.objects.order_by('pk')[:SAMPLE_SIZE])
+    repeating = [schedule for schedule in sample if schedule.repeat_type != ScheduleRepeatType.NONE]
+
+    dates = [(schedule, schedule[50] or schedule.start_date) for schedule in repeating]
+    seconds, result = best_of(repeat, lambda: [schedule.next_date(date) for schedule, date in dates])
+    results['next_date_us'] = seconds / len(dates) * 1e6
+
+    seconds, result = best_of(repeat, lambda: [schedule[DEEP_INDEX] for schedule in repeating])
+    results['getitem_deep_us'] = seconds / len(repeating) * 1e6
+
+    def iterate():
+        for schedule in repeating:
+            for i, occurrence in zip(range(100), schedule.iterate_occurrences()):
+                pass
+    seconds, result = best_of(repeat, iterate)
+    results['iterate_100_us'] = seconds / len(repeating) * 1e6
+
+    for days in WINDOWS:
+        window = TODAY, TODAY + datetime.timedelta(days=days - 1)
+        with CaptureQueriesContext(connection) as queries:
+            seconds, occurrences = best_of(repeat, lambda: sum(1 for o in Schedule.objects.lookup(*window)))
+        results['lookup_%dd_ms' % days] = seconds * 1e3
+        results['lookup_%dd_queries' % days] = len(queries) // repeat
+        results['lookup_%dd_occurrences' % days] = occurrences
+
+    return results
+
+
+def compare(baseline, results, tolerance):
+    regressions = []
+    for size, metrics in sorted(results['sizes'].items()):
+        for metric, value in sorted(metrics.items()):
+            old = baseline['sizes'].get(size, {}).get(metric)
+            if old is None:
+                continue
+            if metric.endswith(('_us', '_ms')) and value > old * (1 + tolerance):
+                regressions.append('%s schedules: %s went from %.2f to %.2f' % (size, metric, old, value))
+            elif metric.endswith('_queries') and value > old:
+                regressions.append('%s schedules: %s went from %d to %d' % (size, metric, old, value))
+            elif metric.endswith('_occurrences') and value != old:
+                regressions.append('%s schedules: %s changed from %d to %d' % (size, metric, old, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tinyschedule on synthetic schedules.')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES),
+                        help='comma separated numbers of schedules (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the best one counts')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare the results to this JSON baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown against the baseline (default: %(default)s)')
+    options = parser.parse_args()
+
+    try:
+        call_command('migrate', verbosity=0)
+        results = {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'machine': platform.machine(),
+            'sizes': {},
+        }
+        for size in [int(size) for size in options.sizes.split(',')]:
+            populate(size)
+            results['sizes'][str(size)] = metrics = benchmark(size, options.repeat)
+            print('%d schedules' % size)
+            for metric, value in sorted(metrics.items()):
+                print('    %-28s %12.2f' % (metric, value))
+    finally:
+        shutil.rmtree(DATABASE_DIR)
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+            output.write('\n')
+
+    if options.compare:
+        with open(options.compare) as baseline:
+            regressions = compare(json.load(baseline), results, options.tolerance)
+        for regression in regressions:
+            print('REGRESSION: %s' % regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -36,7 +36,12 @@ setup(
     ],
     include_package_data=True,
     install_requires=[
+        'django>=4.1',
+        'six',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
     license="BSD",
     zip_safe=False,
     keywords='django-tinyschedule',
@@ -46,10 +51,10 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: BSD License',
         'Natural Language :: English',
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.6',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
 )
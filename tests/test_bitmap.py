@@ -0,0 +1,76 @@
+from django.test import TestCase
+
+from tinyschedule.bitmap import Bitmap
+from tinyschedule.models import Schedule, ScheduleRepeatType
+
+import datetime
+
+
+class BitmapTests(TestCase):
+    def setUp(self):
+        self.start, self.end = datetime.date(2014, 7, 1), datetime.date(2014, 7, 31)
+
+        self.every3days = Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 27),
+            repeat_type=ScheduleRepeatType.DAILY,
+            repeat_every=3)
+
+        self.every2weeksmonwedfri = Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 30),
+            repeat_type=ScheduleRepeatType.WEEKLY,
+            monday=True, wednesday=True, friday=True,
+            repeat_every=2)
+
+        self.everymonth = Schedule.objects.create(
+            start_date=datetime.date(2014, 1, 15),
+            end_date=datetime.date(2014, 8, 31),
+            repeat_type=ScheduleRepeatType.MONTHLY)
+
+        self.finished = Schedule.objects.create(
+            start_date=datetime.date(2014, 1, 29),
+            end_after_occurrences=5,
+            repeat_type=ScheduleRepeatType.MONTHLY,
+            repeat_every=2,
+            monthly_is_based_on_weekday=True)
+
+    def test_to_bitmap(self):
+        for schedule in Schedule.objects.all():
+            bitmap = schedule.to_bitmap(self.start, self.end)
+            occurrences = [occurrence for occurrence, index in schedule.occurrences_between(self.start, self.end)]
+            self.assertEqual(bitmap.dates(), occurrences)
+            self.assertEqual(len(bitmap), len(occurrences))
+
+    def test_set_algebra(self):
+        daily = self.every3days.to_bitmap(self.start, self.end)
+        weekly = self.every2weeksmonwedfri.to_bitmap(self.start, self.end)
+
+        self.assertEqual(list(daily & weekly), [datetime.date(2014, 7, 18), datetime.date(2014, 7, 30)])
+        self.assertEqual(len(daily | weekly), 10 + 7 - 2)
+        self.assertEqual(len(weekly - daily), 5)
+        self.assertEqual(len(~daily), 31 - 10)
+        self.assertIn(datetime.date(2014, 7, 2), weekly)
+        self.assertNotIn(datetime.date(2014, 7, 7), weekly)
+
+        self.assertEqual(Bitmap.union(self.start, self.end, [daily, weekly]), daily | weekly)
+        self.assertEqual(Bitmap.intersection(self.start, self.end, [daily, weekly]), daily & weekly)
+        self.assertEqual(Bitmap.intersection(self.start, self.end, []), ~Bitmap(self.start, self.end))
+
+        with self.assertRaises(ValueError):
+            daily | self.every3days.to_bitmap(self.start, datetime.date(2014, 8, 31))
+
+    def test_bytes(self):
+        bitmap = self.every2weeksmonwedfri.to_bitmap(self.start, self.end)
+        data = bitmap.to_bytes()
+        self.assertEqual(len(data), 4)
+        self.assertEqual(Bitmap.from_bytes(self.start, self.end, data), bitmap)
+
+    def test_to_bitmaps(self):
+        with self.assertNumQueries(1):
+            bitmaps = Schedule.objects.to_bitmaps(self.start, self.end)
+
+        self.assertEqual(sorted(bitmaps), sorted(Schedule.objects.values_list('pk', flat=True)))
+        self.assertEqual(bitmaps[self.everymonth.pk].dates(), [datetime.date(2014, 7, 15)])
+        self.assertEqual(bitmaps[self.finished.pk].dates(), [datetime.date(2014, 7, 30)])
+
+        bitmaps = Schedule.objects.to_bitmaps(datetime.date(2014, 10, 1), datetime.date(2014, 10, 31))
+        self.assertNotIn(self.finished.pk, bitmaps)
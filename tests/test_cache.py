@@ -0,0 +1,129 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from tinyschedule.cache import occurrence_cache, lookup_cache
+from tinyschedule.models import Schedule, ScheduleRepeatType
+
+import datetime
+
+
+class OccurrenceCacheTests(TestCase):
+    def setUp(self):
+        occurrence_cache.clear()
+        self.every2weeksmonwedfri = Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 30),
+            repeat_type=ScheduleRepeatType.WEEKLY,
+            monday=True, wednesday=True, friday=True,
+            repeat_every=2)
+        self.window = (datetime.date(2014, 7, 1), datetime.date(2014, 7, 31))
+
+    def tearDown(self):
+        occurrence_cache.clear()
+
+    def test_hits_and_misses(self):
+        first = list(self.every2weeksmonwedfri.occurrences_between(*self.window))
+        second = list(self.every2weeksmonwedfri.occurrences_between(*self.window))
+        self.assertEqual(first, second)
+
+        # Other schedules with the same rule share the run
+        same = Schedule.objects.get(pk=self.every2weeksmonwedfri.pk)
+        self.assertEqual(list(same.occurrences_between(*self.window)), first)
+
+        self.assertEqual(occurrence_cache.stats(), {
+            'hits': 2, 'misses': 1, 'evictions': 0, 'size': 1, 'maxsize': occurrence_cache.default_size})
+
+    def test_forever_is_not_cached(self):
+        occurrences = self.every2weeksmonwedfri.occurrences_between(self.window[0])
+        self.assertEqual(next(occurrences), (datetime.date(2014, 7, 2), 1))
+        self.assertEqual(occurrence_cache.stats()['size'], 0)
+
+    def test_without_end_is_not_cached(self):
+        finite = Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 30),
+            end_after_occurrences=2000000,
+            repeat_type=ScheduleRepeatType.DAILY)
+        self.assertEqual(next(iter(finite.iterate_occurrences())), datetime.date(2014, 6, 30))
+        self.assertEqual(occurrence_cache.stats()['size'], 0)
+
+    @override_settings(TINYSCHEDULE_OCCURRENCE_CACHE_MAX_RUN=10)
+    def test_long_run_is_not_cached(self):
+        list(self.every2weeksmonwedfri.occurrences_between(datetime.date(2014, 7, 1), datetime.date(2014, 7, 14)))
+        self.assertEqual(occurrence_cache.stats()['size'], 1)
+        list(self.every2weeksmonwedfri.occurrences_between(datetime.date(2014, 7, 1), datetime.date(2014, 9, 30)))
+        self.assertEqual(occurrence_cache.stats()['size'], 1)
+
+    @override_settings(TINYSCHEDULE_OCCURRENCE_CACHE_SIZE=2)
+    def test_eviction(self):
+        for month in range(7, 11):
+            list(self.every2weeksmonwedfri.occurrences_between(
+                datetime.date(2014, month, 1), datetime.date(2014, month, 28)))
+        stats = occurrence_cache.stats()
+        self.assertEqual((stats['size'], stats['evictions'], stats['maxsize']), (2, 2, 2))
+
+    @override_settings(TINYSCHEDULE_OCCURRENCE_CACHE_SIZE=0)
+    def test_disabled(self):
+        list(self.every2weeksmonwedfri.occurrences_between(*self.window))
+        self.assertEqual(occurrence_cache.stats()['size'], 0)
+
+    def test_invalidate_on_save(self):
+        list(self.every2weeksmonwedfri.occurrences_between(*self.window))
+        self.every2weeksmonwedfri.repeat_every = 1
+        self.every2weeksmonwedfri.save()
+        self.assertEqual(occurrence_cache.stats()['size'], 0)
+
+        self.assertEqual(
+            [occurrence for occurrence, index in self.every2weeksmonwedfri.occurrences_between(*self.window)][:4],
+            [datetime.date(2014, 7, 2), datetime.date(2014, 7, 4), datetime.date(2014, 7, 7), datetime.date(2014, 7, 9)])
+
+
+class LookupCacheTests(TestCase):
+    def setUp(self):
+        lookup_cache.cache.clear()
+        self.everyday = Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 30),
+            repeat_type=ScheduleRepeatType.DAILY)
+        self.every3days = Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 27),
+            repeat_type=ScheduleRepeatType.DAILY,
+            repeat_every=3)
+        self.window = (datetime.date(2014, 7, 1), datetime.date(2014, 7, 10))
+
+    def tearDown(self):
+        lookup_cache.cache.clear()
+
+    def test_hit(self):
+        expected = list(Schedule.objects.lookup(*self.window, cached=True))
+        self.assertEqual(expected, list(Schedule.objects.lookup(*self.window)))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(list(Schedule.objects.lookup(*self.window, cached=True)), expected)
+
+    def test_scope(self):
+        list(Schedule.objects.lookup(*self.window, cached=True))
+        schedules_qs = Schedule.objects.filter(pk=self.every3days.pk)
+        self.assertEqual(
+            list(Schedule.objects.lookup(*self.window, schedules_queryset=schedules_qs, cached=True)),
+            list(Schedule.objects.lookup(*self.window, schedules_queryset=schedules_qs)))
+        self.assertEqual(
+            list(Schedule.objects.lookup(*self.window, schedules_queryset=Schedule.objects.none(), cached=True)),
+            [])
+        self.assertEqual(len(list(Schedule.objects.lookup(*self.window, ordered=True, limit=3, cached=True))), 3)
+
+    def test_invalidate_on_save_and_delete(self):
+        list(Schedule.objects.lookup(*self.window, cached=True))
+
+        self.every3days.repeat_every = 5
+        self.every3days.save()
+        self.assertEqual(
+            list(Schedule.objects.lookup(*self.window, cached=True)),
+            list(Schedule.objects.lookup(*self.window)))
+
+        self.everyday.delete()
+        self.assertEqual(
+            list(Schedule.objects.lookup(*self.window, cached=True)),
+            list(Schedule.objects.lookup(*self.window)))
+
+    def test_generation(self):
+        generation = lookup_cache.generation(Schedule)
+        lookup_cache.bump_generation(Schedule)
+        self.assertEqual(lookup_cache.generation(Schedule), generation + 1)
@@ -0,0 +1,153 @@
+from django.core.management import call_command
+from django.test import TestCase
+
+from tinyschedule.dispatcher import Dispatcher
+from tinyschedule.models import DispatchCheckpoint, Schedule, ScheduleRepeatType
+
+import datetime
+
+
+fired = []
+
+
+def record(schedule, date, index):
+    fired.append((schedule.pk, date, index))
+
+
+class Clock(object):
+    def __init__(self, now):
+        self.current = now
+
+    def __call__(self):
+        return self.current
+
+    def advance(self, **kwargs):
+        self.current += datetime.timedelta(**kwargs)
+
+
+class DispatcherTests(TestCase):
+    def setUp(self):
+        self.every2days = Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 28),
+            repeat_type=ScheduleRepeatType.DAILY,
+            repeat_every=2)
+
+        self.mondays = Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 30),
+            end_after_occurrences=2,
+            repeat_type=ScheduleRepeatType.WEEKLY,
+            monday=True)
+
+        self.clock = Clock(datetime.datetime(2014, 6, 30, 8, 0))
+        del fired[:]
+
+    def dispatcher(self):
+        dispatcher = Dispatcher(now=self.clock)
+        dispatcher.max_sleep = 7 * 24 * 3600
+        dispatcher.register(record)
+        return dispatcher
+
+    def test_run_pending(self):
+        dispatcher = self.dispatcher()
+        self.assertEqual(dispatcher.run_pending(), 2)
+        self.assertEqual(sorted(fired), [
+            (self.every2days.pk, datetime.date(2014, 6, 30), 1),
+            (self.mondays.pk, datetime.date(2014, 6, 30), 0),
+        ])
+        # Nothing is due until midnight of July 2nd
+        self.assertEqual(dispatcher.run_pending(), 0)
+        self.assertEqual(dispatcher.seconds_until_due(), 40 * 3600)
+
+        self.clock.advance(days=7)
+        dispatcher.run_pending()
+        self.assertEqual(fired[2:], [
+            (self.every2days.pk, datetime.date(2014, 7, 2), 2),
+            (self.every2days.pk, datetime.date(2014, 7, 4), 3),
+            (self.every2days.pk, datetime.date(2014, 7, 6), 4),
+            (self.mondays.pk, datetime.date(2014, 7, 7), 1),
+        ])
+        # The schedule of two mondays is done
+        self.assertNotIn(self.mondays.pk, dispatcher._queued)
+
+        checkpoint = DispatchCheckpoint.objects.get(object_id=self.every2days.pk)
+        self.assertEqual((checkpoint.date, checkpoint.index), (datetime.date(2014, 7, 6), 4))
+
+    def test_restart(self):
+        self.dispatcher().run_pending()
+        self.clock.advance(days=2)
+
+        # A new dispatcher continues after the checkpoints
+        self.assertEqual(self.dispatcher().run_pending(), 1)
+        self.assertEqual(fired[2:], [(self.every2days.pk, datetime.date(2014, 7, 2), 2)])
+
+    def test_schedule_changes(self):
+        dispatcher = self.dispatcher()
+        dispatcher.start()
+        self.addCleanup(dispatcher.stop)
+        dispatcher.run_pending()
+
+        # Today was fired already, the changed rule continues tomorrow
+        self.every2days.repeat_every = 1
+        self.every2days.save()
+        other = Schedule.objects.create(start_date=datetime.date(2014, 7, 1), repeat_type=ScheduleRepeatType.DAILY)
+        self.mondays.delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(dispatcher.seconds_until_due(), 16 * 3600)
+
+        self.clock.advance(days=7)
+        dispatcher.run_pending()
+        self.assertEqual([(pk, date) for pk, date, index in fired[2:]], [
+            (self.every2days.pk, datetime.date(2014, 7, 1)),
+            (other.pk, datetime.date(2014, 7, 1)),
+            (self.every2days.pk, datetime.date(2014, 7, 2)),
+            (other.pk, datetime.date(2014, 7, 2)),
+        ] + [(pk, datetime.date(2014, 7, day)) for day in range(3, 8) for pk in (self.every2days.pk, other.pk)])
+
+    def test_failing_handler(self):
+        dispatcher = self.dispatcher()
+
+        @dispatcher.register
+        def fail(schedule, date, index):
+            if schedule == self.mondays:
+                raise ValueError
+
+        with self.assertLogs('tinyschedule', 'ERROR'):
+            self.assertEqual(dispatcher.run_pending(), 1)
+        self.assertFalse(DispatchCheckpoint.objects.filter(object_id=self.mondays.pk).exists())
+        self.assertTrue(DispatchCheckpoint.objects.filter(object_id=self.every2days.pk).exists())
+
+    def test_retry_failed_occurrence(self):
+        dispatcher = self.dispatcher()
+        failures = [ValueError]
+
+        @dispatcher.register
+        def fail_once(schedule, date, index):
+            if schedule == self.mondays and failures:
+                raise failures.pop()
+
+        with self.assertLogs('tinyschedule', 'ERROR'):
+            self.assertEqual(dispatcher.run_pending(), 1)
+        # Retried after retry_interval, not dropped
+        self.assertEqual(dispatcher.run_pending(), 0)
+        self.assertEqual(dispatcher.seconds_until_due(), dispatcher.retry_interval)
+
+        self.clock.advance(seconds=dispatcher.retry_interval)
+        self.assertEqual(dispatcher.run_pending(), 1)
+        self.assertEqual(fired[-1], (self.mondays.pk, datetime.date(2014, 6, 30), 0))
+        checkpoint = DispatchCheckpoint.objects.get(object_id=self.mondays.pk)
+        self.assertEqual((checkpoint.date, checkpoint.index), (datetime.date(2014, 6, 30), 0))
+
+        # The schedule moves on once the occurrence went through
+        self.clock.advance(days=7)
+        dispatcher.run_pending()
+        self.assertEqual(fired[-1], (self.mondays.pk, datetime.date(2014, 7, 7), 1))
+
+    def test_run_until_stopped(self):
+        dispatcher = self.dispatcher()
+        dispatcher.register(lambda schedule, date, index: dispatcher.stop())
+        dispatcher.run()
+        self.assertEqual(len(fired), 1)
+
+    def test_command(self):
+        call_command('dispatch_occurrences', '--once', '--handler', 'tests.test_dispatcher.record')
+        self.assertEqual(DispatchCheckpoint.objects.count(), len(fired))
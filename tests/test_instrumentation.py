@@ -0,0 +1,70 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from tinyschedule.instrumentation import lookup_finished
+from tinyschedule.models import Schedule, ScheduleRepeatType
+
+import datetime
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        self.everyday = Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 30),
+            repeat_type=ScheduleRepeatType.DAILY)
+
+        self.every2weeksmonwedfri = Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 30),
+            repeat_type=ScheduleRepeatType.WEEKLY,
+            monday=True, wednesday=True, friday=True,
+            repeat_every=2)
+
+        self.finished = Schedule.objects.create(
+            start_date=datetime.date(2014, 1, 29),
+            end_after_occurrences=5,
+            repeat_type=ScheduleRepeatType.MONTHLY)
+
+        self.metrics = []
+        lookup_finished.connect(self.receive, sender=Schedule)
+        self.addCleanup(lookup_finished.disconnect, self.receive, sender=Schedule)
+
+    def receive(self, sender, metrics, **kwargs):
+        self.metrics.append(metrics)
+
+    def test_lookup(self):
+        start, end = datetime.date(2014, 7, 7), datetime.date(2014, 7, 13)
+        lookup = list(Schedule.objects.lookup(start, end))
+
+        metrics, = self.metrics
+        self.assertEqual((metrics.name, metrics.start, metrics.end), ('lookup', start, end))
+        self.assertEqual(metrics.queries, 1)
+        self.assertEqual(metrics.schedules, 2)
+        self.assertEqual(metrics.yielded, len(lookup))
+        self.assertEqual(metrics.generated, len(lookup))
+        # 7 days and 3 weekdays of the first week were seeked over
+        self.assertEqual(metrics.skipped, 10)
+        self.assertEqual(sorted(pk for seconds, pk in metrics.slowest),
+                         [self.everyday.pk, self.every2weeksmonwedfri.pk])
+        self.assertGreater(metrics.wall_time, 0)
+
+    def test_lookup_ordered_limit(self):
+        list(Schedule.objects.lookup(datetime.date(2014, 7, 7), datetime.date(2014, 7, 20), ordered=True, limit=3))
+
+        metrics, = self.metrics
+        self.assertEqual(metrics.yielded, 3)
+        # The merge reads one occurrence ahead of every schedule
+        self.assertEqual(metrics.generated, 4)
+
+    def test_iterate_occurrences(self):
+        occurrences = list(self.finished.iterate_occurrences())
+
+        metrics, = self.metrics
+        self.assertEqual(metrics.name, 'iterate_occurrences')
+        self.assertEqual((metrics.queries, metrics.schedules, metrics.skipped), (0, 1, 0))
+        self.assertEqual(metrics.yielded, len(occurrences))
+
+    @override_settings(TINYSCHEDULE_SLOW_LOOKUP_THRESHOLD=0)
+    def test_slow_lookup(self):
+        with self.assertLogs('tinyschedule', 'WARNING') as logs:
+            list(Schedule.objects.lookup(datetime.date(2014, 7, 7)))
+        self.assertIn('Slow lookup of tinyschedule.Schedule between 2014-07-07 and 2014-07-07', logs.output[0])
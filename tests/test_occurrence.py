@@ -0,0 +1,96 @@
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from tinyschedule.models import Schedule, ScheduleRepeatType, Occurrence, OccurrenceHorizon
+
+import datetime
+
+
+@override_settings(TINYSCHEDULE_OCCURRENCE_HORIZON=120)
+class OccurrenceTests(TestCase):
+    def setUp(self):
+        self.today = datetime.date.today()
+
+        self.everyday = Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 30),
+            repeat_type=ScheduleRepeatType.DAILY)
+
+        self.every2weeksmonwedfri = Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 30),
+            repeat_type=ScheduleRepeatType.WEEKLY,
+            monday=True, wednesday=True, friday=True,
+            repeat_every=2)
+
+        self.finished = Schedule.objects.create(
+            start_date=datetime.date(2014, 1, 29),
+            end_after_occurrences=5,
+            repeat_type=ScheduleRepeatType.MONTHLY,
+            repeat_every=2,
+            monthly_is_based_on_weekday=True)
+
+        call_command('materialize_occurrences')
+
+    def window(self, start, end):
+        return self.today + datetime.timedelta(days=start), self.today + datetime.timedelta(days=end)
+
+    def test_materialize(self):
+        horizon = OccurrenceHorizon.objects.get()
+        self.assertEqual(horizon.start_date, self.today)
+        self.assertEqual(horizon.end_date, self.today + datetime.timedelta(days=120))
+
+        self.assertEqual(Occurrence.objects.filter(object_id=self.everyday.pk).count(), 121)
+        self.assertFalse(Occurrence.objects.filter(object_id=self.finished.pk).exists())
+
+    def test_lookup_materialized(self):
+        start, end = self.window(10, 40)
+        expected = sorted(Schedule.objects.lookup(start, end), key=lambda l: (l[0], l[1].pk))
+
+        with self.assertNumQueries(3):
+            lookup = list(Schedule.objects.lookup(start, end, materialized=True))
+
+        self.assertEqual(lookup, expected)
+
+    def test_lookup_materialized_limit(self):
+        start, end = self.window(10, 40)
+        self.assertEqual(
+            list(Schedule.objects.lookup(start, end, materialized=True, limit=4)),
+            list(Schedule.objects.lookup(start, end, materialized=True))[:4])
+
+    def test_lookup_materialized_outside_horizon(self):
+        start, end = self.window(100, 200)
+        self.assertEqual(
+            list(Schedule.objects.lookup(start, end, materialized=True)),
+            list(Schedule.objects.lookup(start, end)))
+
+    def test_save_and_delete(self):
+        self.everyday.repeat_every = 7
+        self.everyday.save()
+        start, end = self.window(0, 120)
+        self.assertEqual(
+            list(Occurrence.objects.filter(object_id=self.everyday.pk).order_by('date').values_list('date', 'index')),
+            list(self.everyday.occurrences_between(start, end)))
+
+        self.everyday.delete()
+        self.assertFalse(Occurrence.objects.filter(object_id=self.everyday.pk).exists())
+
+    def test_extend_horizon(self):
+        tomorrow = self.today + datetime.timedelta(days=1)
+        Occurrence.objects.extend_horizon(Schedule, today=tomorrow)
+
+        start, end = tomorrow, tomorrow + datetime.timedelta(days=120)
+        self.assertEqual(
+            list(Occurrence.objects.filter(object_id=self.every2weeksmonwedfri.pk)
+                 .order_by('date').values_list('date', 'index')),
+            list(self.every2weeksmonwedfri.occurrences_between(start, end)))
+        self.assertFalse(Occurrence.objects.filter(date__lt=tomorrow).exists())
+
+    def test_extend_lapsed_horizon(self):
+        later = self.today + datetime.timedelta(days=200)
+        Occurrence.objects.extend_horizon(Schedule, today=later)
+
+        horizon = OccurrenceHorizon.objects.get()
+        self.assertEqual((horizon.start_date, horizon.end_date), (later, later + datetime.timedelta(days=120)))
+        self.assertEqual(
+            list(Occurrence.objects.filter(object_id=self.everyday.pk).order_by('date').values_list('date', 'index')),
+            list(self.everyday.occurrences_between(later, horizon.end_date)))
@@ -1,8 +1,11 @@
+from asgiref.sync import sync_to_async
+from django.db import connection
 from django.test import TestCase
 
 from tinyschedule.models import Schedule, ScheduleRepeatType
 
 import datetime
+import itertools
 import six
 
 
@@ -108,6 +111,125 @@ class ScheduleTests(TestCase):
         self.assertTrue((datetime.date(2014, 7, 14), self.every2weeksmonwedfri) in lookup)
         self.assertTrue((datetime.date(2014, 7, 28), self.every2weeksmonwedfri) in lookup)
 
+    def test_lookup_num_queries(self):
+        schedules_qs = Schedule.objects.exclude(pk=self.simple.pk)
+        with self.assertNumQueries(1):
+            lookup = list(Schedule.objects.lookup(
+                datetime.date(2014, 7, 7), datetime.date(2014, 7, 30), schedules_qs))
+        self.assertTrue(len(lookup) > 0)
+        self.assertIsNone(schedules_qs._result_cache)
+
+        with self.assertNumQueries(1):
+            list(Schedule.objects.lookup(datetime.date(2014, 6, 30)))
+
+    def test_lookup_simple_with_end_date(self):
+        simple = Schedule.objects.create(
+            start_date=datetime.date(2014, 7, 2),
+            end_date=datetime.date(2014, 7, 2))
+        lookup = list(Schedule.objects.lookup(datetime.date(2014, 7, 1), datetime.date(2014, 7, 3)))
+        self.assertTrue((simple.start_date, simple, 0) in lookup)
+        self.assertFalse(any(schedule == self.simple for occurrence, schedule, i in lookup))
+
+    def test_denormalized_fields(self):
+        self.assertEqual(self.fiveoccurrences.last_occurrence_date, datetime.date(2014, 9, 24))
+        self.assertEqual(self.every2daysuntil.last_occurrence_date, datetime.date(2014, 7, 14))
+        self.assertEqual(self.yearly.last_occurrence_date, datetime.date(2016, 2, 29))
+        self.assertEqual(self.simple.last_occurrence_date, self.simple.start_date)
+        self.assertEqual(self.everyday.last_occurrence_date, None)
+
+        self.assertEqual(self.every2weeksmonwedfri.weekday_mask, 0b10101)
+        self.assertEqual(self.every2weeksmonwedfri.period, 14)
+        self.assertEqual(self.every3days.period, 3)
+        self.assertEqual(self.everymonthweekday3.period, 2)
+        self.assertEqual(self.yearly.period, 24)
+
+        self.everyday.end_after_occurrences = 3
+        self.everyday.save(update_fields=['end_after_occurrences'])
+        self.assertEqual(Schedule.objects.get(pk=self.everyday.pk).last_occurrence_date,
+                         datetime.date(2014, 7, 2))
+
+    def test_denormalized_fields_past_date_max(self):
+        # The last occurrence would fall after date.max, so these never end
+        for rule in [dict(repeat_type=ScheduleRepeatType.YEARLY, end_after_occurrences=9999),
+                     dict(repeat_type=ScheduleRepeatType.MONTHLY, end_after_occurrences=100000),
+                     dict(repeat_type=ScheduleRepeatType.DAILY, end_date=datetime.date.max),
+                     dict(repeat_type=ScheduleRepeatType.DAILY, repeat_every=1000, end_after_occurrences=10000)]:
+            schedule = Schedule.objects.create(start_date=datetime.date(2014, 1, 31), **rule)
+            self.assertEqual(schedule.last_occurrence_date, None, rule)
+            self.assertEqual(schedule.count_occurrences(), None, rule)
+            self.assertIsNotNone(schedule.seek(datetime.date(2020, 1, 1)), rule)
+
+    def test_denormalized_fields_end_date(self):
+        for end_date in ['2030-01-01', datetime.datetime(2030, 1, 1, 12, 0)]:
+            schedule = Schedule.objects.create(
+                start_date=datetime.date(2014, 1, 1),
+                end_date=end_date,
+                repeat_type=ScheduleRepeatType.DAILY)
+            self.assertEqual(schedule.end_date, datetime.date(2030, 1, 1))
+            self.assertEqual(schedule.last_occurrence_date, datetime.date(2030, 1, 1))
+
+    def test_lookup_prunes_finished_schedules(self):
+        schedules = Schedule.objects._lookup_queryset(datetime.date(2014, 10, 1), datetime.date(2014, 10, 31))
+        self.assertFalse(schedules.filter(pk=self.fiveoccurrences.pk).exists())
+        self.assertFalse(schedules.filter(pk=self.everymonth.pk).exists())
+        self.assertTrue(schedules.filter(pk=self.everyday.pk).exists())
+
+    def test_lookup_ordered(self):
+        start, end = datetime.date(2014, 6, 1), datetime.date(2015, 6, 30)
+        lookup = list(Schedule.objects.lookup(start, end, ordered=True))
+        self.assertEqual([l[0] for l in lookup], sorted(l[0] for l in lookup))
+        self.assertEqual(sorted(lookup, key=lambda l: (l[0], l[1].pk, l[2])),
+                         sorted(Schedule.objects.lookup(start, end), key=lambda l: (l[0], l[1].pk, l[2])))
+
+    def test_lookup_ordered_limit(self):
+        start, end = datetime.date(2014, 6, 1), datetime.date(2030, 12, 31)
+        with self.assertNumQueries(1):
+            lookup = list(Schedule.objects.lookup(start, end, ordered=True, limit=5))
+        self.assertEqual(lookup, [
+            (datetime.date(2014, 6, 4), self.everymonthweekday2, 5),
+            (datetime.date(2014, 6, 15), self.everymonth, 5),
+            (datetime.date(2014, 6, 18), self.everymonthweekday, 5),
+            (datetime.date(2014, 6, 27), self.every3days, 0),
+            (datetime.date(2014, 6, 28), self.every2daysuntil, 0)])
+
+        self.assertEqual(len(list(Schedule.objects.lookup(start, end, limit=3))), 3)
+
+    def test_stream_lookup(self):
+        start, end = datetime.date(2014, 6, 1), datetime.date(2014, 12, 31)
+        expected = sorted(Schedule.objects.lookup(start, end), key=lambda l: (l[1].pk, l[2]))
+
+        with self.assertNumQueries(1):
+            lookup = list(Schedule.objects.stream_lookup(start, end, chunk_size=3))
+        self.assertEqual(sorted(lookup, key=lambda l: (l[1], l[2])),
+                         [(occurrence, schedule.pk, index) for occurrence, schedule, index in expected])
+
+        # One query for the rules, and one per chunk of 5 schedules
+        with self.assertNumQueries(4):
+            lookup = list(Schedule.objects.stream_lookup(start, end, chunk_size=5, hydrate=True))
+        self.assertEqual(sorted(lookup, key=lambda l: (l[1].pk, l[2])), expected)
+
+    def test_parallel_lookup(self):
+        start, end = datetime.date(2014, 6, 1), datetime.date(2014, 12, 31)
+        schedules = Schedule.objects.order_by('pk')
+        self.assertEqual(
+            list(Schedule.objects.parallel_lookup(start, end, workers=2, chunk_size=3)),
+            list(Schedule.objects.lookup(start, end, schedules)))
+        self.assertEqual(
+            list(Schedule.objects.parallel_lookup(start, end, workers=2, chunk_size=3, ordered=True)),
+            list(Schedule.objects.lookup(start, end, schedules, ordered=True)))
+
+    async def test_alookup(self):
+        start, end = datetime.date(2014, 6, 1), datetime.date(2014, 12, 31)
+        lookup = [l async for l in Schedule.objects.alookup(start, end, chunk_size=4)]
+        expected = await sync_to_async(list)(Schedule.objects.lookup(start, end))
+        self.assertEqual(lookup, expected)
+
+        schedules_qs = Schedule.objects.filter(pk=self.fiveoccurrences.pk)
+        lookup = [l async for l in Schedule.objects.alookup(start, end, schedules_qs)]
+        self.assertEqual(lookup, [
+            (datetime.date(2014, 7, 30), self.fiveoccurrences, 3),
+            (datetime.date(2014, 9, 24), self.fiveoccurrences, 4)])
+
     def test_next_date_for_weeks(self):
         dates = []
         date = self.every2weeksmonwedfri.start_date
@@ -269,9 +391,320 @@ class ScheduleTests(TestCase):
 
         self.assertEqual(lookup, expected)
 
+    def test_occurrences_between_daily(self):
+        old_daily = Schedule.objects.create(
+            start_date=datetime.date(2015, 1, 1),
+            repeat_type=ScheduleRepeatType.DAILY,
+            repeat_every=3)
+
+        expected = [(occurrence, i) for i, occurrence in enumerate(
+            old_daily.iterate_occurrences(datetime.date(2026, 1, 20)))
+            if occurrence >= datetime.date(2026, 1, 1)]
+
+        self.assertEqual(
+            list(old_daily.occurrences_between(datetime.date(2026, 1, 1), datetime.date(2026, 1, 20))),
+            expected)
+        self.assertEqual(expected[0], (datetime.date(2026, 1, 3), 1340))
+
+    def test_occurrences_between_end_conditions(self):
+        ten_days = Schedule.objects.create(
+            start_date=datetime.date(2014, 1, 1),
+            end_after_occurrences=10,
+            repeat_type=ScheduleRepeatType.DAILY,
+            repeat_every=2)
+
+        self.assertEqual(
+            list(ten_days.occurrences_between(datetime.date(2014, 1, 15), datetime.date(2014, 2, 28))),
+            [(datetime.date(2014, 1, 15), 7),
+             (datetime.date(2014, 1, 17), 8),
+             (datetime.date(2014, 1, 19), 9)])
+
+        self.assertEqual(
+            list(self.every2daysuntil.occurrences_between(datetime.date(2014, 7, 13))),
+            [(datetime.date(2014, 7, 14), 8)])
+
+        self.assertEqual(
+            list(self.simple.occurrences_between(datetime.date(2014, 6, 1), datetime.date(2014, 7, 1))),
+            [(datetime.date(2014, 6, 30), 0)])
+        self.assertEqual(list(self.simple.occurrences_between(datetime.date(2014, 7, 1))), [])
+
+    def test_occurrences_between_weekly(self):
+        window = (datetime.date(2016, 3, 1), datetime.date(2016, 3, 31))
+        expected = [(occurrence, i) for i, occurrence in enumerate(
+            self.every2weeksmonwedfri.iterate_occurrences(window[1]))
+            if occurrence >= window[0]]
+
+        self.assertEqual(list(self.every2weeksmonwedfri.occurrences_between(*window)), expected)
+        self.assertEqual(expected[0], (datetime.date(2016, 3, 7), 132))
+
+    def test_occurrences_between_weekly_unselected_start(self):
+        # Starts on a Tuesday, which is not one of the selected weekdays.
+        schedule = Schedule.objects.create(
+            start_date=datetime.date(2014, 7, 1),
+            repeat_type=ScheduleRepeatType.WEEKLY,
+            repeat_every=3,
+            monday=True, thursday=True)
+
+        self.assertEqual(
+            list(schedule.occurrences_between(datetime.date(2014, 6, 1), datetime.date(2014, 7, 31))),
+            [(datetime.date(2014, 7, 1), 0),
+             (datetime.date(2014, 7, 3), 1),
+             (datetime.date(2014, 7, 21), 2),
+             (datetime.date(2014, 7, 24), 3)])
+        self.assertEqual(
+            list(schedule.occurrences_between(datetime.date(2014, 7, 22), datetime.date(2014, 8, 11))),
+            [(datetime.date(2014, 7, 24), 3),
+             (datetime.date(2014, 8, 11), 4)])
+
+    def test_next_date_for_months_skips_bad_months(self):
+        schedule = Schedule.objects.create(
+            start_date=datetime.date(2015, 12, 31),
+            repeat_type=ScheduleRepeatType.MONTHLY)
+
+        self.assertEqual(
+            list(schedule.iterate_occurrences(datetime.date(2016, 8, 31))),
+            [datetime.date(2015, 12, 31),
+             datetime.date(2016, 1, 31),
+             datetime.date(2016, 3, 31),
+             datetime.date(2016, 5, 31),
+             datetime.date(2016, 7, 31),
+             datetime.date(2016, 8, 31)])
+        self.assertEqual(
+            list(schedule.occurrences_between(datetime.date(2016, 2, 1), datetime.date(2016, 4, 30))),
+            [(datetime.date(2016, 3, 31), 2)])
+
+    def test_next_date_for_months_based_on_fourth_weekday(self):
+        # The 4th thursday of April 2015 is not the last one. It should not
+        # turn into the last thursday after a month with only 4 thursdays.
+        schedule = Schedule.objects.create(
+            start_date=datetime.date(2015, 4, 23),
+            repeat_type=ScheduleRepeatType.MONTHLY,
+            monthly_is_based_on_weekday=True)
+
+        self.assertEqual(
+            list(schedule.iterate_occurrences(datetime.date(2015, 8, 31))),
+            [datetime.date(2015, 4, 23),
+             datetime.date(2015, 5, 28),
+             datetime.date(2015, 6, 25),
+             datetime.date(2015, 7, 23),
+             datetime.date(2015, 8, 27)])
+
+    def test_occurrences_between_monthly(self):
+        window = (datetime.date(2015, 3, 1), datetime.date(2015, 8, 31))
+        for schedule in (self.everymonthweekday, self.everymonthweekday2, self.everymonthweekday3):
+            expected = [(occurrence, i) for i, occurrence in enumerate(schedule.iterate_occurrences(window[1]))
+                        if occurrence >= window[0]]
+            self.assertEqual(list(schedule.occurrences_between(*window)), expected)
+
+        self.assertEqual(
+            list(self.everymonthweekday3.occurrences_between(*window)),
+            [(datetime.date(2015, 3, 25), 7),
+             (datetime.date(2015, 5, 27), 8),
+             (datetime.date(2015, 7, 29), 9)])
+
     def test_occurrence_lookup(self):
         self.assertEqual(self.every2weeksmonwedfri[25], datetime.date(2014, 10, 22))
 
+    def test_occurrence_lookup_deep(self):
+        self.assertEqual(self.everyday[4000], datetime.date(2025, 6, 12))
+        self.assertEqual(self.every2weeksmonwedfri[2400], datetime.date(2045, 2, 27))
+        self.assertEqual(self.yearly[2], datetime.date(2016, 2, 29))
+        self.assertEqual(self.yearly[3], None)
+        self.assertEqual(self.simple[0], self.simple.start_date)
+        self.assertEqual(self.simple[1], None)
+
+    def test_occurrence_lookup_negative(self):
+        self.assertEqual(self.fiveoccurrences[-1], datetime.date(2014, 9, 24))
+        self.assertEqual(self.fiveoccurrences[-5], datetime.date(2014, 1, 29))
+        self.assertEqual(self.fiveoccurrences[-6], None)
+        self.assertEqual(self.every2daysuntil[-1], datetime.date(2014, 7, 14))
+
+        with self.assertRaises(IndexError):
+            self.everyday[-1]
+
+    def test_occurrence_slices(self):
+        self.assertEqual(self.every2weeksmonwedfri[24:27], [
+            datetime.date(2014, 10, 20),
+            datetime.date(2014, 10, 22),
+            datetime.date(2014, 10, 24)])
+        self.assertEqual(self.everyday[100:300:100], [
+            datetime.date(2014, 10, 8),
+            datetime.date(2015, 1, 16)])
+        self.assertEqual(self.fiveoccurrences[3:], [
+            datetime.date(2014, 7, 30),
+            datetime.date(2014, 9, 24)])
+        self.assertEqual(self.fiveoccurrences[-2:], self.fiveoccurrences[3:])
+
+        with self.assertRaises(IndexError):
+            self.everyday[100:]
+
+    def test_index_of(self):
+        self.assertEqual(self.every2weeksmonwedfri.index_of(datetime.date(2014, 10, 22)), 25)
+        self.assertEqual(self.every2weeksmonwedfri.index_of(datetime.date(2014, 10, 23)), None)
+        self.assertEqual(self.every2weeksmonwedfri.index_of(datetime.date(2014, 10, 29)), None)
+        self.assertEqual(self.yearly.index_of(datetime.date(2014, 2, 28)), 1)
+        self.assertEqual(self.yearly.index_of(datetime.date(2018, 2, 28)), None)
+        self.assertEqual(self.everymonthweekday3.index_of(datetime.date(2015, 7, 29)), 9)
+        self.assertEqual(self.everyday.index_of(datetime.date(2014, 6, 29)), None)
+        self.assertEqual(self.simple.index_of(self.simple.start_date), 0)
+
+    def test_occurs_on(self):
+        self.assertTrue(self.every2weeksmonwedfri.occurs_on(datetime.date(2014, 10, 22)))
+        self.assertFalse(self.every2weeksmonwedfri.occurs_on(datetime.date(2014, 10, 29)))
+        self.assertTrue(self.every2daysuntil.occurs_on(datetime.date(2014, 7, 14)))
+        self.assertFalse(self.every2daysuntil.occurs_on(datetime.date(2014, 7, 16)))
+        self.assertTrue(self.fiveoccurrences.occurs_on(datetime.date(2014, 9, 24)))
+        self.assertFalse(self.fiveoccurrences.occurs_on(datetime.date(2014, 11, 26)))
+        self.assertTrue(self.yearly2.occurs_on(datetime.date(2018, 1, 1)))
+        self.assertFalse(self.yearly2.occurs_on(datetime.date(2019, 1, 1)))
+        self.assertTrue(self.simple.occurs_on(datetime.date(2014, 6, 30)))
+        self.assertFalse(self.simple.occurs_on(datetime.date(2014, 7, 1)))
+
+    def test_occurs_on_many(self):
+        dates = [self.everymonth.start_date + datetime.timedelta(days=i) for i in range(365)]
+        self.assertEqual(
+            [date for date, occurs in zip(dates, self.everymonth.occurs_on_many(dates)) if occurs],
+            list(self.everymonth.iterate_occurrences()))
+
+    def test_count_occurrences(self):
+        start, end = datetime.date(2014, 7, 7), datetime.date(2015, 3, 1)
+        for schedule in Schedule.objects.all():
+            self.assertEqual(schedule.count_occurrences(start, end), len(list(schedule.occurrences_between(start, end))))
+
+        self.assertEqual(self.fiveoccurrences.count_occurrences(), 5)
+        self.assertEqual(self.fiveoccurrences.count_occurrences(datetime.date(2014, 6, 1)), 2)
+        self.assertEqual(self.every2daysuntil.count_occurrences(end=datetime.date(2014, 7, 1)), 2)
+        self.assertIsNone(self.everyday.count_occurrences(datetime.date(2014, 6, 1)))
+        self.assertEqual(self.everyday.count_occurrences(datetime.date(2014, 6, 1), datetime.date(2014, 6, 30)), 1)
+
+    def test_count_by_schedule(self):
+        start, end = datetime.date(2014, 7, 7), datetime.date(2015, 3, 1)
+        expected = {}
+        for occurrence, schedule, index in Schedule.objects.lookup(start, end):
+            expected[schedule.pk] = expected.get(schedule.pk, 0) + 1
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Schedule.objects.count_by_schedule(start, end), expected)
+
+        schedules = Schedule.objects.filter(repeat_type=ScheduleRepeatType.DAILY)
+        self.assertEqual(Schedule.objects.count_by_schedule(start, end, schedules), {
+            self.everyday.pk: 238,
+            self.every3days.pk: 79,
+            self.every2daysuntil.pk: 4,
+        })
+
+    def test_daily_counts(self):
+        start, end = datetime.date(2014, 6, 1), datetime.date(2014, 9, 30)
+        expected = [0] * 122
+        for occurrence, schedule, index in Schedule.objects.lookup(start, end):
+            expected[(occurrence - start).days] += 1
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Schedule.objects.daily_counts(start, end), expected)
+
+        schedules = Schedule.objects.filter(repeat_type=ScheduleRepeatType.DAILY)
+        self.assertEqual(Schedule.objects.daily_counts(datetime.date(2014, 6, 27), datetime.date(2014, 7, 3), schedules),
+                         [1, 1, 0, 3, 1, 2, 2])
+
+    def test_sql_occurrences(self):
+        Schedule.objects.create(
+            start_date=datetime.date(2014, 1, 31),
+            repeat_type=ScheduleRepeatType.MONTHLY,
+            end_after_occurrences=6)
+        start, end = datetime.date(2012, 1, 1), datetime.date(2016, 12, 31)
+        expected = sorted(
+            (occurrence, schedule.pk, index)
+            for schedule in Schedule.objects.all()
+            for occurrence, index in zip(schedule.iterate_occurrences(end), itertools.count())
+            if occurrence >= start)
+
+        occurrences = Schedule.objects.occurrences(start, end)
+        with self.assertNumQueries(1):
+            self.assertEqual([(date, pk, index) for pk, date, index in occurrences], expected)
+        self.assertEqual(occurrences.count(), len(expected))
+
+        # Aggregated inside the database
+        sql, params = Schedule.objects.occurrences(start, end).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT schedule_id, COUNT(*) FROM (%s) occurrences GROUP BY schedule_id' % sql, params)
+            counts = dict(cursor.fetchall())
+        self.assertEqual(counts[self.everyday.pk], (end - self.everyday.start_date).days + 1)
+        self.assertEqual(counts[self.yearly.pk], 3)
+
+        # Narrowed down by any queryset of schedules
+        self.assertEqual(
+            list(Schedule.objects.filter(pk=self.yearly.pk).occurrences(start, end)),
+            [(pk, date, index) for date, pk, index in expected if pk == self.yearly.pk])
+
+    def test_occurring_on(self):
+        Schedule.objects.create(
+            start_date=datetime.date(2014, 1, 31),
+            repeat_type=ScheduleRepeatType.MONTHLY)
+        schedules = list(Schedule.objects.all())
+        day = datetime.date(2014, 1, 1)
+        while day < datetime.date(2016, 12, 31):
+            expected = sorted(schedule.pk for schedule in schedules if schedule.occurs_on(day))
+            self.assertEqual(sorted(Schedule.objects.occurring_on(day).values_list('pk', flat=True)), expected, day)
+            day += datetime.timedelta(days=5)
+
+        # February 29 falls back to the 28th in other years
+        self.assertIn(self.yearly, Schedule.objects.occurring_on(datetime.date(2014, 2, 28)))
+        self.assertNotIn(self.yearly, Schedule.objects.occurring_on(datetime.date(2016, 2, 28)))
+
+        with self.assertNumQueries(1):
+            page = list(Schedule.objects.filter(repeat_type=ScheduleRepeatType.DAILY)
+                        .occurring_on(datetime.date(2014, 7, 3)).order_by('pk')[:2])
+        self.assertEqual(page, [self.everyday, self.every3days])
+
+    def test_intersect(self):
+        self.assertEqual(
+            list(self.every3days.intersect(self.every2daysuntil)),
+            [datetime.date(2014, 6, 30), datetime.date(2014, 7, 6), datetime.date(2014, 7, 12)])
+        self.assertEqual(
+            list(self.every3days.intersect(self.every2weeksmonwedfri, limit=4)),
+            [datetime.date(2014, 6, 30),
+             datetime.date(2014, 7, 18),
+             datetime.date(2014, 7, 30),
+             datetime.date(2014, 8, 11)])
+        start, end = datetime.date(2014, 7, 1), datetime.date(2014, 8, 1)
+        self.assertEqual(
+            list(self.every3days.intersect(self.every2weeksmonwedfri, start, end)),
+            [datetime.date(2014, 7, 18), datetime.date(2014, 7, 30)])
+        self.assertEqual(list(self.every2weeksmonwedfri.intersect(self.everymonth)), [datetime.date(2014, 8, 15)])
+
+    def test_intersect_forever(self):
+        # Two schedules that never end collide until date.max
+        yearly = Schedule(start_date=datetime.date(2014, 7, 15), repeat_type=ScheduleRepeatType.YEARLY)
+        monthly = Schedule(start_date=datetime.date(2014, 1, 15), repeat_type=ScheduleRepeatType.MONTHLY)
+        daily = Schedule(start_date=datetime.date(2014, 1, 1), repeat_type=ScheduleRepeatType.DAILY)
+        expected = [datetime.date(year, 7, 15) for year in range(2014, datetime.MAXYEAR + 1)]
+        self.assertEqual(list(yearly.intersect(monthly)), expected)
+        self.assertEqual(list(yearly.intersect(daily)), expected)
+        every1000days = Schedule(start_date=datetime.date(2014, 1, 1), repeat_type=ScheduleRepeatType.DAILY,
+                                 repeat_every=1000)
+        self.assertEqual(list(every1000days.intersect(daily))[-1], datetime.date(9997, 9, 27))
+
+    def test_intersect_never(self):
+        mondays = Schedule(start_date=datetime.date(2014, 6, 30), repeat_type=ScheduleRepeatType.WEEKLY, monday=True)
+        tuesdays = Schedule(start_date=datetime.date(2014, 7, 1), repeat_type=ScheduleRepeatType.WEEKLY, tuesday=True)
+        self.assertEqual(list(mondays.intersect(tuesdays)), [])
+
+        # The 31st of a month is never the 28th of February
+        every31st = Schedule(start_date=datetime.date(2014, 1, 31), repeat_type=ScheduleRepeatType.MONTHLY)
+        every28feb = Schedule(start_date=datetime.date(2014, 2, 28), repeat_type=ScheduleRepeatType.YEARLY)
+        self.assertEqual(list(every31st.intersect(every28feb)), [])
+
+    def test_find_collisions(self):
+        schedules = Schedule.objects.filter(pk__in=[self.simple.pk, self.every3days.pk, self.every2daysuntil.pk])
+        self.assertEqual(list(Schedule.objects.find_collisions(schedules, limit=2)), [
+            (self.every3days, self.every2daysuntil, [datetime.date(2014, 6, 30), datetime.date(2014, 7, 6)]),
+            (self.every3days, self.simple, [datetime.date(2014, 6, 30)]),
+            (self.every2daysuntil, self.simple, [datetime.date(2014, 6, 30)]),
+        ])
+        self.assertEqual(list(schedules.find_collisions(start=datetime.date(2014, 7, 13))), [])
+        self.assertEqual(list(schedules.filter(pk__in=[self.simple.pk, self.every3days.pk]).find_collisions()),
+                         [(self.every3days, self.simple, [datetime.date(2014, 6, 30)])])
+
     def test_description(self):
         self.assertEqual(six.text_type(self.everymonthweekday3),
                          'every two months on the last wednesday from 01/29/2014 until 08/31/2015')
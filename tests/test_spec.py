@@ -0,0 +1,81 @@
+from django.test import SimpleTestCase
+
+from tinyschedule.models import Schedule
+from tinyschedule.spec import ScheduleSpec, ScheduleRepeatType, count_valid_steps, month_index, valid_step
+
+import calendar
+import datetime
+import pickle
+import subprocess
+import sys
+
+
+class ScheduleSpecTests(SimpleTestCase):
+    def setUp(self):
+        self.every2weeksmonwedfri = ScheduleSpec(
+            start_date=datetime.date(2014, 6, 30),
+            repeat_type=ScheduleRepeatType.WEEKLY,
+            monday=True, wednesday=True, friday=True,
+            repeat_every=2)
+
+        self.everymonth31 = ScheduleSpec(
+            start_date=datetime.date(2014, 1, 31),
+            end_after_occurrences=5,
+            repeat_type=ScheduleRepeatType.MONTHLY)
+
+    def test_same_as_model(self):
+        for spec in (self.every2weeksmonwedfri, self.everymonth31):
+            schedule = Schedule(start_date=spec.start_date, end_after_occurrences=spec.end_after_occurrences,
+                                repeat_type=spec.repeat_type, repeat_every=spec.repeat_every,
+                                monday=spec.monday, wednesday=spec.wednesday, friday=spec.friday)
+            self.assertEqual(schedule.to_spec(), spec)
+            end = datetime.date(2015, 1, 1)
+            self.assertEqual(list(spec.iterate_occurrences(end)), list(schedule.iterate_occurrences(end)))
+            self.assertEqual(spec[3], schedule[3])
+
+    def test_occurrences(self):
+        self.assertEqual(
+            list(self.everymonth31.iterate_occurrences()),
+            [datetime.date(2014, 1, 31),
+             datetime.date(2014, 3, 31),
+             datetime.date(2014, 5, 31),
+             datetime.date(2014, 7, 31),
+             datetime.date(2014, 8, 31)])
+        self.assertEqual(self.every2weeksmonwedfri.next_date(datetime.date(2014, 7, 4)), datetime.date(2014, 7, 14))
+
+    def test_seek(self):
+        self.assertEqual(self.every2weeksmonwedfri.seek(datetime.date(2014, 7, 5)), (datetime.date(2014, 7, 14), 3))
+        self.assertEqual(self.everymonth31.seek(datetime.date(2014, 6, 1)), (datetime.date(2014, 7, 31), 3))
+        self.assertIsNone(self.everymonth31.seek(datetime.date(2014, 9, 1)))
+
+    def test_every_29th(self):
+        # Only February of a common year lacks the 29th, 2100 is one
+        for start, every in ((datetime.date(2096, 2, 29), 48), (datetime.date(2014, 1, 29), 1),
+                             (datetime.date(2015, 11, 29), 3)):
+            first_month = month_index(start)
+            valid = [step for step in range(2000)
+                     if calendar.monthrange((first_month + step * every) // 12,
+                                            (first_month + step * every) % 12 + 1)[1] >= 29]
+            self.assertEqual([count_valid_steps(first_month, every, 29, step) for step in range(2000)],
+                             [sum(1 for v in valid if v < step) for step in range(2000)])
+            self.assertEqual([valid_step(first_month, every, 29, index) for index in range(len(valid))], valid)
+
+        spec = ScheduleSpec(start_date=datetime.date(2096, 2, 29), repeat_type=ScheduleRepeatType.MONTHLY,
+                            repeat_every=48)
+        self.assertEqual(spec[1], datetime.date(2104, 2, 29))
+
+    def test_value(self):
+        spec = ScheduleSpec(datetime.datetime(2014, 1, 31, 12, 0), end_after_occurrences=5,
+                            repeat_type=ScheduleRepeatType.MONTHLY)
+        self.assertEqual(spec, self.everymonth31)
+        self.assertEqual(len(set([spec, self.everymonth31, self.every2weeksmonwedfri])), 2)
+        self.assertEqual(pickle.loads(pickle.dumps(spec)), spec)
+        self.assertFalse(hasattr(spec, '__dict__'))
+        with self.assertRaises(AttributeError):
+            spec.repeat_every = 2
+
+    def test_without_django(self):
+        modules = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys, tinyschedule.spec; print(sorted(m for m in sys.modules if m.startswith("django")))'])
+        self.assertEqual(modules.strip(), b'[]')
@@ -0,0 +1,91 @@
+from django.test import TestCase
+
+from tinyschedule.models import Schedule, ScheduleRepeatType
+from tinyschedule import vectorized
+
+import datetime
+import unittest
+
+
+@unittest.skipIf(vectorized.np is None, 'NumPy is not installed')
+class VectorizedTests(TestCase):
+    def setUp(self):
+        Schedule.objects.create(start_date=datetime.date(2014, 6, 30))
+        Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 27),
+            repeat_type=ScheduleRepeatType.DAILY,
+            repeat_every=3)
+        Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 28),
+            end_date=datetime.date(2014, 7, 15),
+            repeat_type=ScheduleRepeatType.DAILY,
+            repeat_every=2)
+        Schedule.objects.create(
+            start_date=datetime.date(2014, 6, 30),
+            repeat_type=ScheduleRepeatType.WEEKLY,
+            monday=True, wednesday=True, friday=True,
+            repeat_every=2)
+        Schedule.objects.create(
+            start_date=datetime.date(2014, 7, 1),
+            end_after_occurrences=10,
+            repeat_type=ScheduleRepeatType.WEEKLY,
+            monday=True, thursday=True,
+            repeat_every=3)
+        Schedule.objects.create(
+            start_date=datetime.date(2015, 12, 31),
+            repeat_type=ScheduleRepeatType.MONTHLY)
+        Schedule.objects.create(
+            start_date=datetime.date(2014, 1, 29),
+            end_after_occurrences=5,
+            repeat_type=ScheduleRepeatType.MONTHLY,
+            repeat_every=2,
+            monthly_is_based_on_weekday=True)
+        Schedule.objects.create(
+            start_date=datetime.date(2015, 4, 23),
+            repeat_type=ScheduleRepeatType.MONTHLY,
+            monthly_is_based_on_weekday=True)
+        Schedule.objects.create(
+            start_date=datetime.date(2012, 2, 29),
+            end_after_occurrences=3,
+            repeat_type=ScheduleRepeatType.YEARLY,
+            repeat_every=2)
+
+    def assertMatchesLookup(self, start, end):
+        dates, schedule_ids, indices = vectorized.expand(Schedule.objects.all(), start, end)
+        self.assertEqual(dates.dtype.str, '<M8[D]')
+        self.assertEqual(
+            list(zip(dates.astype(object), schedule_ids.tolist(), indices.tolist())),
+            sorted((occurrence, schedule.pk, index)
+                   for occurrence, schedule, index in Schedule.objects.lookup(start, end)))
+
+    def test_expand(self):
+        self.assertMatchesLookup(datetime.date(2014, 1, 1), datetime.date(2014, 12, 31))
+        self.assertMatchesLookup(datetime.date(2014, 7, 10), datetime.date(2016, 3, 1))
+        self.assertMatchesLookup(datetime.date(2026, 1, 1), datetime.date(2026, 12, 31))
+
+    def test_expand_schedules(self):
+        start, end = datetime.date(2014, 1, 1), datetime.date(2020, 12, 31)
+        for expanded, expected in zip(vectorized.expand(list(Schedule.objects.all()), start, end),
+                                      vectorized.expand(Schedule.objects.all(), start, end)):
+            self.assertEqual(expanded.tolist(), expected.tolist())
+
+    def test_expand_specs(self):
+        start, end = datetime.date(2014, 1, 1), datetime.date(2020, 12, 31)
+        schedules = list(Schedule.objects.all())
+        specs = [schedule.to_spec() for schedule in schedules]
+
+        dates, positions, indices = vectorized.expand(specs, start, end)
+        self.assertEqual(
+            list(zip(dates.astype(object), positions.tolist(), indices.tolist())),
+            sorted((occurrence, position, index) for position, spec in enumerate(specs)
+                   for occurrence, index in spec._occurrences_between(start, end)))
+
+        for expanded, expected in zip(vectorized.expand([(schedule.pk, schedule.to_spec()) for schedule in schedules],
+                                                        start, end),
+                                      vectorized.expand(Schedule.objects.all(), start, end)):
+            self.assertEqual(expanded.tolist(), expected.tolist())
+
+    def test_expand_nothing(self):
+        dates, schedule_ids, indices = vectorized.expand(
+            Schedule.objects.none(), datetime.date(2014, 1, 1), datetime.date(2014, 12, 31))
+        self.assertEqual(len(dates), 0)
@@ -0,0 +1,10 @@
+from __future__ import unicode_literals
+from django.apps import AppConfig
+
+
+class TinyScheduleConfig(AppConfig):
+    name = 'tinyschedule'
+    verbose_name = 'Tiny schedule'
+
+    def ready(self):
+        from . import signals  # noqa
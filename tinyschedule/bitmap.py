@@ -0,0 +1,156 @@
+"""
+Day-indexed bitmaps of schedules.
+
+A ``Bitmap`` is the set of days between ``start`` and ``end`` (both
+inclusive) on which something happens, as the bits of a Python integer: bit
+``i`` is the day ``start + i``. Union, intersection and difference are a
+single integer operation, so set algebra over many schedules does not create
+any ``datetime.date``.
+"""
+from __future__ import unicode_literals
+
+import datetime
+
+
+def stride_bits(first, step, count):
+    """
+    Give an integer with the ``count`` bits ``first``, ``first + step``, ...
+    set, built by doubling instead of setting every bit.
+    """
+    if count <= 0:
+        return 0
+    bits, covered = 1, 1
+    while covered < count:
+        bits |= bits << (step * covered)
+        covered *= 2
+    return (bits & ((1 << (step * (count - 1) + 1)) - 1)) << first
+
+
+class Bitmap(object):
+    """
+    The days between ``start`` and ``end`` (both inclusive) in ``bits``.
+    Bitmaps of the same horizon support ``|``, ``&``, ``-`` and ``^``, and
+    iterate over their dates in order.
+    """
+    __slots__ = ('start', 'end', 'bits')
+
+    def __init__(self, start, end, bits=0):
+        self.start = start
+        self.end = end
+        self.bits = bits & ((1 << self.days) - 1)
+
+    @classmethod
+    def from_dates(cls, start, end, dates):
+        base, last = start.toordinal(), end.toordinal()
+        bits = 0
+        for date in dates:
+            ordinal = date.toordinal()
+            if base <= ordinal <= last:
+                bits |= 1 << (ordinal - base)
+        return cls(start, end, bits)
+
+    @classmethod
+    def from_bytes(cls, start, end, data):
+        """
+        The inverse of ``to_bytes``.
+        """
+        return cls(start, end, int.from_bytes(bytes(data), 'little'))
+
+    @classmethod
+    def union(cls, start, end, bitmaps):
+        """
+        The days of any of ``bitmaps``.
+        """
+        bits = 0
+        for bitmap in bitmaps:
+            bits |= cls._check(start, end, bitmap).bits
+        return cls(start, end, bits)
+
+    @classmethod
+    def intersection(cls, start, end, bitmaps):
+        """
+        The days of all of ``bitmaps``.
+        """
+        bits = (1 << ((end - start).days + 1)) - 1
+        for bitmap in bitmaps:
+            bits &= cls._check(start, end, bitmap).bits
+        return cls(start, end, bits)
+
+    @staticmethod
+    def _check(start, end, bitmap):
+        if (bitmap.start, bitmap.end) != (start, end):
+            raise ValueError('Bitmaps of %s - %s and %s - %s can not be combined' % (
+                start, end, bitmap.start, bitmap.end))
+        return bitmap
+
+    @property
+    def days(self):
+        """
+        The number of days in the horizon.
+        """
+        return max(0, (self.end - self.start).days + 1)
+
+    def to_bytes(self):
+        """
+        The bits as a ``bytearray`` of ``ceil(days / 8)`` bytes, the first
+        day being the lowest bit of the first byte.
+        """
+        return bytearray(self.bits.to_bytes((self.days + 7) // 8, 'little'))
+
+    def popcount(self):
+        return bin(self.bits).count('1')
+
+    def dates(self):
+        """
+        The dates in this bitmap, in order.
+        """
+        base = self.start.toordinal()
+        # Scan the binary digits from the lowest bit instead of testing bits
+        digits = bin(self.bits)[:1:-1]
+        dates = []
+        index = digits.find('1')
+        while index >= 0:
+            dates.append(datetime.date.fromordinal(base + index))
+            index = digits.find('1', index + 1)
+        return dates
+
+    def __or__(self, other):
+        return Bitmap(self.start, self.end, self.bits | self._check(self.start, self.end, other).bits)
+
+    def __and__(self, other):
+        return Bitmap(self.start, self.end, self.bits & self._check(self.start, self.end, other).bits)
+
+    def __sub__(self, other):
+        return Bitmap(self.start, self.end, self.bits & ~self._check(self.start, self.end, other).bits)
+
+    def __xor__(self, other):
+        return Bitmap(self.start, self.end, self.bits ^ self._check(self.start, self.end, other).bits)
+
+    def __invert__(self):
+        return Bitmap(self.start, self.end, ~self.bits)
+
+    def __contains__(self, date):
+        return self.start <= date <= self.end and bool(self.bits >> (date - self.start).days & 1)
+
+    def __iter__(self):
+        return iter(self.dates())
+
+    def __len__(self):
+        return self.popcount()
+
+    def __bool__(self):
+        return self.bits != 0
+
+    __nonzero__ = __bool__
+
+    def __eq__(self, other):
+        if not isinstance(other, Bitmap):
+            return NotImplemented
+        return (self.start, self.end, self.bits) == (other.start, other.end, other.bits)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return '<Bitmap %s - %s: %d days>' % (self.start, self.end, self.popcount())
@@ -0,0 +1,137 @@
+from __future__ import unicode_literals
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet
+
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+
+class OccurrenceCache(object):
+    """
+    A process-local LRU cache of expanded runs of occurrences. The keys
+    start with the fingerprint of the rule of a schedule, so schedules with
+    the same rule share their runs. The number of runs is bounded by the
+    ``TINYSCHEDULE_OCCURRENCE_CACHE_SIZE`` setting, ``0`` disables it, and
+    the length of a run by ``TINYSCHEDULE_OCCURRENCE_CACHE_MAX_RUN``.
+    """
+    default_size = 256
+    default_max_run = 1000
+
+    def __init__(self):
+        self._runs = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def maxsize(self):
+        return getattr(settings, 'TINYSCHEDULE_OCCURRENCE_CACHE_SIZE', self.default_size)
+
+    @property
+    def max_run(self):
+        return getattr(settings, 'TINYSCHEDULE_OCCURRENCE_CACHE_MAX_RUN', self.default_max_run)
+
+    def get(self, key):
+        with self._lock:
+            run = self._runs.get(key)
+            if run is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._runs.move_to_end(key)
+            return run
+
+    def set(self, key, run):
+        with self._lock:
+            self._runs[key] = run
+            self._runs.move_to_end(key)
+            while len(self._runs) > self.maxsize:
+                self._runs.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, fingerprint):
+        """
+        Drop all runs of the rule with ``fingerprint``.
+        """
+        with self._lock:
+            for key in [key for key in self._runs if key[0] == fingerprint]:
+                del self._runs[key]
+
+    def clear(self):
+        with self._lock:
+            self._runs.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._runs),
+            'maxsize': self.maxsize,
+        }
+
+
+occurrence_cache = OccurrenceCache()
+
+
+class LookupCache(object):
+    """
+    Keeps the results of lookups as compact ``(occurrence, pk, index)``
+    tuples in the Django cache set by ``TINYSCHEDULE_LOOKUP_CACHE``. Every
+    schedule model has a generation counter which is bumped when one of its
+    schedules is saved or deleted, so older results are never read again.
+    """
+    default_timeout = 300
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'TINYSCHEDULE_LOOKUP_CACHE', 'default')]
+
+    def _generation_key(self, model):
+        return 'tinyschedule:generation:%s' % model._meta.label_lower
+
+    def _first_generation(self):
+        # Start from the clock, so a counter that got evicted from the cache
+        # never comes back to a generation which was used before.
+        return int(time.time() * 1000)
+
+    def generation(self, model):
+        key = self._generation_key(model)
+        self.cache.add(key, self._first_generation(), None)
+        return self.cache.get(key)
+
+    def bump_generation(self, model):
+        key = self._generation_key(model)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, self._first_generation(), None)
+
+    def key(self, model, schedules_queryset, *args):
+        """
+        Give the key of a lookup of ``model`` within ``schedules_queryset``.
+        ``args`` are the remaining arguments of the lookup.
+        """
+        if schedules_queryset is None:
+            scope = ''
+        else:
+            try:
+                scope = '%s %r' % schedules_queryset.query.sql_with_params()
+            except EmptyResultSet:
+                scope = 'none'
+        digest = hashlib.md5(('%s %r' % (scope, args)).encode('utf-8')).hexdigest()
+        return 'tinyschedule:lookup:%s:%s:%s' % (model._meta.label_lower, self.generation(model), digest)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, occurrences):
+        self.cache.set(key, occurrences, getattr(settings, 'TINYSCHEDULE_LOOKUP_CACHE_TIMEOUT', self.default_timeout))
+
+
+lookup_cache = LookupCache()
@@ -0,0 +1,261 @@
+"""
+Fire handlers for the occurrences of schedules as they become due.
+
+A ``Dispatcher`` keeps the next occurrence of every schedule in a min-heap of
+``(date, pk)``. It sleeps until the earliest one is due, calls the registered
+handlers with ``(schedule, date, index)`` and pushes the next occurrence of
+that schedule back, found with ``next_date``, so the schedules are not
+expanded again on every run.
+
+Every fired occurrence is checkpointed in ``DispatchCheckpoint``, in the same
+transaction as the handlers, and a restarted dispatcher continues right
+after the checkpoints. An occurrence whose handler raises is retried after
+``retry_interval`` seconds, and its schedule waits for it.
+"""
+from __future__ import unicode_literals
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from .models import DispatchCheckpoint, Schedule, ScheduleRepeatType
+
+import datetime
+import heapq
+import logging
+import threading
+
+
+logger = logging.getLogger('tinyschedule')
+
+
+class Dispatcher(object):
+    """
+    Fire the occurrences of the schedules of ``model`` (narrowed down by
+    ``schedules_queryset``) on the day they are due. Register handlers with
+    ``register``, then ``run()`` until ``stop()``, or call ``run_pending()``
+    from a loop of your own.
+
+    Schedules without a checkpoint start with their occurrences of today.
+    Schedules saved or deleted in this process are requeued through signals,
+    changes made by other processes are picked up every ``reload_interval``
+    seconds.
+    """
+    # Wake up at least this often, in seconds, to notice a change of date
+    max_sleep = 3600
+    # Seconds before an occurrence whose handler raised is fired again
+    retry_interval = 60
+
+    def __init__(self, model=Schedule, schedules_queryset=None, reload_interval=None, now=datetime.datetime.now):
+        self.model = model
+        self.schedules_queryset = schedules_queryset
+        self.reload_interval = reload_interval
+        self.now = now
+        self.handlers = []
+        self._heap = []
+        # pk -> (date, index, schedule) of the occurrence that is queued
+        self._queued = {}
+        # pk -> date of the last fired occurrence
+        self._fired = {}
+        # (time, pk, date) of the failed occurrences to fire again
+        self._retries = []
+        self._changed = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._loaded_at = None
+
+    def register(self, handler):
+        """
+        Call ``handler(schedule, date, index)`` for every due occurrence.
+        Returns ``handler``, so this works as a decorator.
+        """
+        self.handlers.append(handler)
+        return handler
+
+    @property
+    def content_type(self):
+        return ContentType.objects.get_for_model(self.model)
+
+    def _schedules(self):
+        if self.schedules_queryset is None:
+            return self.model._default_manager.all()
+        return self.schedules_queryset
+
+    def _queue(self, schedule, start):
+        """
+        Queue the first occurrence of ``schedule`` on or after ``start``.
+        """
+        self._queued.pop(schedule.pk, None)
+        occurrence = schedule.seek(start)
+        if occurrence is not None:
+            self._push(schedule, *occurrence)
+
+    def _push(self, schedule, date, index):
+        self._queued[schedule.pk] = (date, index, schedule)
+        heapq.heappush(self._heap, (date, schedule.pk))
+
+    def _advance(self, schedule, date, index):
+        """
+        Queue the occurrence after ``(date, index)`` of ``schedule``.
+        """
+        self._queued.pop(schedule.pk, None)
+        if schedule.repeat_type == ScheduleRepeatType.NONE:
+            return
+        count = schedule._occurrence_count()
+        if count is not None and index + 1 >= count:
+            return
+        next_date = schedule.next_date(date)
+        if schedule.end_date is not None and next_date > schedule.end_date:
+            return
+        self._push(schedule, next_date, index + 1)
+
+    def load(self):
+        """
+        Rebuild the heap from the database: every schedule continues after
+        its checkpoint, or starts today.
+        """
+        today = self.now().date()
+        self._fired = dict(DispatchCheckpoint.objects.filter(content_type=self.content_type)
+                           .values_list('object_id', 'date'))
+        starts = dict((pk, fired + datetime.timedelta(days=1)) for pk, fired in self._fired.items())
+        self._heap = []
+        self._queued = {}
+        self._retries = []
+        # Schedules that ended after their checkpoint still have to catch up
+        since = min([today] + list(starts.values()))
+        schedules = self.model._default_manager._lookup_queryset(since, datetime.date.max, self._schedules())
+        for schedule in schedules.iterator():
+            self._queue(schedule, starts.get(schedule.pk, today))
+        self._loaded_at = self.now()
+
+    def _schedule_changed(self, sender, instance, **kwargs):
+        with self._lock:
+            self._changed.add(instance.pk)
+        self._wakeup.set()
+
+    def _apply_changes(self):
+        """
+        Requeue the schedules that were saved or deleted since the last
+        call, with a single query. Like on ``load()``, a changed schedule
+        continues after its checkpoint, or starts today.
+        """
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        if not changed:
+            return
+        today = self.now().date()
+        schedules = self._schedules().in_bulk(changed)
+        for pk in changed:
+            self._queued.pop(pk, None)
+            if pk in schedules:
+                fired = self._fired.get(pk)
+                self._queue(schedules[pk], today if fired is None else fired + datetime.timedelta(days=1))
+
+    def _fire(self, schedule, date, index):
+        try:
+            with transaction.atomic():
+                for handler in self.handlers:
+                    handler(schedule, date, index)
+                DispatchCheckpoint.objects.update_or_create(
+                    content_type=self.content_type, object_id=schedule.pk,
+                    defaults={'date': date, 'index': index})
+        except Exception:
+            logger.exception('Dispatching occurrence %d of %s on %s failed', index, schedule.pk, date)
+            return False
+        self._fired[schedule.pk] = date
+        return True
+
+    def _requeue_retries(self):
+        """
+        Put the failed occurrences whose ``retry_interval`` has passed back
+        on the heap, unless their schedule was changed in the meantime.
+        """
+        now = self.now()
+        retries = []
+        for retry in self._retries:
+            at, pk, date = retry
+            if at > now:
+                retries.append(retry)
+            elif self._queued.get(pk, (None,))[0] == date:
+                heapq.heappush(self._heap, (date, pk))
+        self._retries = retries
+
+    def run_pending(self):
+        """
+        Fire every occurrence that is due by now, and give how many were
+        fired. A handler that raises is logged, and its occurrence is not
+        checkpointed: it stays queued and is fired again after
+        ``retry_interval`` seconds, before the later occurrences of its
+        schedule.
+        """
+        if self._loaded_at is None or (self.reload_interval is not None and
+                                       (self.now() - self._loaded_at).total_seconds() >= self.reload_interval):
+            self.load()
+        self._apply_changes()
+        self._requeue_retries()
+
+        today = self.now().date()
+        fired = 0
+        while self._heap and self._heap[0][0] <= today and not self._stopped:
+            date, pk = heapq.heappop(self._heap)
+            queued = self._queued.get(pk)
+            if queued is None or queued[0] != date:
+                # Replaced by a change to the schedule
+                continue
+            date, index, schedule = queued
+            if self._fire(schedule, date, index):
+                fired += 1
+                self._advance(schedule, date, index)
+            else:
+                retry_at = self.now() + datetime.timedelta(seconds=self.retry_interval)
+                self._retries.append((retry_at, pk, date))
+        return fired
+
+    def seconds_until_due(self):
+        """
+        Give the number of seconds until the next occurrence is due, at
+        midnight of its date, or a failed one is retried, capped by
+        ``max_sleep``.
+        """
+        self._apply_changes()
+        while self._heap and self._queued.get(self._heap[0][1], (None,))[0] != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        seconds = self.max_sleep
+        if self._heap:
+            due = datetime.datetime.combine(self._heap[0][0], datetime.time())
+            seconds = min(seconds, (due - self.now()).total_seconds())
+        if self._retries:
+            seconds = min(seconds, (min(self._retries)[0] - self.now()).total_seconds())
+        if self.reload_interval is not None and self._loaded_at is not None:
+            seconds = min(seconds, self.reload_interval - (self.now() - self._loaded_at).total_seconds())
+        return max(seconds, 0)
+
+    def start(self):
+        post_save.connect(self._schedule_changed, sender=self.model)
+        post_delete.connect(self._schedule_changed, sender=self.model)
+        self._stopped = False
+
+    def stop(self):
+        """
+        Make ``run()`` return. Safe to call from another thread.
+        """
+        self._stopped = True
+        self._wakeup.set()
+        post_save.disconnect(self._schedule_changed, sender=self.model)
+        post_delete.disconnect(self._schedule_changed, sender=self.model)
+
+    def run(self):
+        """
+        Fire due occurrences and sleep until the next one is due, until
+        ``stop()`` is called.
+        """
+        self.start()
+        try:
+            while not self._stopped:
+                self.run_pending()
+                if self._stopped:
+                    break
+                self._wakeup.wait(self.seconds_until_due())
+                self._wakeup.clear()
+        finally:
+            self.stop()
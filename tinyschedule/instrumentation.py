@@ -0,0 +1,136 @@
+"""
+Metrics of lookups and iterations of schedules.
+
+Connect to ``lookup_finished`` to receive a ``LookupMetrics`` after every
+``ScheduleManager.lookup(...)`` and ``AbstractSchedule.iterate_occurrences()``,
+or set ``TINYSCHEDULE_SLOW_LOOKUP_THRESHOLD`` (in seconds) to log the slow
+ones. Nothing is measured when neither is in use.
+"""
+from __future__ import unicode_literals
+from django.conf import settings
+from django.dispatch import Signal
+
+import heapq
+import logging
+import time
+
+
+logger = logging.getLogger('tinyschedule')
+
+# Sent with ``sender`` the schedule model and ``metrics`` a ``LookupMetrics``
+lookup_finished = Signal()
+
+
+class LookupMetrics(object):
+    """
+    What a single lookup (or iteration) cost:
+
+    * ``wall_time``: seconds spent inside the lookup, not in the code that
+      consumes the occurrences.
+    * ``queries``: number of database queries issued.
+    * ``schedules``: number of schedules that were expanded.
+    * ``generated``: occurrences the schedules produced, and ``yielded``:
+      occurrences given to the caller. The difference was thrown away, by a
+      ``limit`` for example.
+    * ``skipped``: occurrences before the window that were seeked over
+      instead of replayed from ``start_date``.
+    * ``slowest``: ``(seconds, pk)`` of the slowest schedules, slowest first.
+    """
+    slowest_size = 5
+
+    def __init__(self, model, name, start, end):
+        self.model = model
+        self.name = name
+        self.start = start
+        self.end = end
+        self.wall_time = 0.0
+        self.queries = 0
+        self.schedules = 0
+        self.generated = 0
+        self.yielded = 0
+        self.skipped = 0
+        self._slowest = []
+
+    @classmethod
+    def begin(cls, model, name, start, end):
+        """
+        Give new metrics, or ``None`` when nobody is interested in them.
+        """
+        if getattr(settings, 'TINYSCHEDULE_SLOW_LOOKUP_THRESHOLD', None) is None \
+                and not lookup_finished.has_listeners(model):
+            return None
+        return cls(model, name, start, end)
+
+    @property
+    def slowest(self):
+        return sorted(self._slowest, reverse=True)
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def measure(self, occurrences, connection=None):
+        """
+        Yield from ``occurrences``, measuring the time spent and the queries
+        issued on ``connection`` in between. Finishes the metrics when the
+        occurrences are exhausted or the caller stops iterating.
+        """
+        iterator = iter(occurrences)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    if connection is None:
+                        occurrence_tuple = next(iterator)
+                    else:
+                        with connection.execute_wrapper(self._count_query):
+                            occurrence_tuple = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.wall_time += time.perf_counter() - started
+                self.yielded += 1
+                yield occurrence_tuple
+        finally:
+            # Let the expansions of all schedules finish before reporting
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            self.finish()
+
+    def track(self, schedule, start, occurrences):
+        """
+        Yield from the ``occurrences`` of ``schedule`` from ``start`` onwards,
+        counting them and timing the schedule.
+        """
+        self.schedules += 1
+        self.skipped += schedule._count_before(start)
+        elapsed = 0.0
+        iterator = iter(occurrences)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    occurrence_tuple = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - started
+                self.generated += 1
+                yield occurrence_tuple
+        finally:
+            if len(self._slowest) < self.slowest_size:
+                heapq.heappush(self._slowest, (elapsed, schedule.pk))
+            else:
+                heapq.heappushpop(self._slowest, (elapsed, schedule.pk))
+
+    def finish(self):
+        lookup_finished.send(sender=self.model, metrics=self)
+
+        threshold = getattr(settings, 'TINYSCHEDULE_SLOW_LOOKUP_THRESHOLD', None)
+        if threshold is not None and self.wall_time >= threshold:
+            logger.warning(
+                'Slow %s of %s between %s and %s: %.3fs, %d queries, %d schedules, '
+                '%d occurrences generated, %d yielded, %d skipped, slowest schedules: %s',
+                self.name, self.model._meta.label, self.start, self.end, self.wall_time, self.queries,
+                self.schedules, self.generated, self.yielded, self.skipped,
+                ', '.join('%s (%.3fs)' % (pk, seconds) for seconds, pk in self.slowest))
@@ -0,0 +1,51 @@
+from __future__ import unicode_literals
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from tinyschedule.dispatcher import Dispatcher
+from tinyschedule.models import AbstractSchedule
+
+
+class Command(BaseCommand):
+    help = 'Call handlers for the occurrences of schedules as they become due. Runs until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--handler', action='append', dest='handlers',
+                            help='dotted path of a handler(schedule, date, index), can be repeated. '
+                                 'Defaults to TINYSCHEDULE_DISPATCH_HANDLERS.')
+        parser.add_argument('--model', default='tinyschedule.Schedule',
+                            help='the schedule model, as app_label.ModelName (default: %(default)s)')
+        parser.add_argument('--reload', type=int, default=300, dest='reload_interval',
+                            help='seconds between reloads of the schedules, to pick up changes made by other '
+                                 'processes (default: %(default)s)')
+        parser.add_argument('--once', action='store_true',
+                            help='fire the occurrences that are due and exit, to run from cron')
+
+    def handle(self, *args, **options):
+        handlers = options['handlers'] or getattr(settings, 'TINYSCHEDULE_DISPATCH_HANDLERS', [])
+        if not handlers:
+            raise CommandError('Pass --handler or set TINYSCHEDULE_DISPATCH_HANDLERS.')
+
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+        if not issubclass(model, AbstractSchedule):
+            raise CommandError('%s is not a schedule model.' % options['model'])
+
+        dispatcher = Dispatcher(model, reload_interval=options['reload_interval'])
+        for handler in handlers:
+            dispatcher.register(import_string(handler))
+
+        if options['once']:
+            fired = dispatcher.run_pending()
+            if options['verbosity'] > 1:
+                self.stdout.write('Fired %d occurrences' % fired)
+            return
+
+        try:
+            dispatcher.run()
+        except KeyboardInterrupt:
+            pass
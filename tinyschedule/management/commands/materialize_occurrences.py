@@ -0,0 +1,20 @@
+from __future__ import unicode_literals
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tinyschedule.models import AbstractSchedule, Occurrence
+
+
+class Command(BaseCommand):
+    help = 'Extend the horizon of the materialized occurrences. Run this every night.'
+
+    def handle(self, *args, **options):
+        if getattr(settings, 'TINYSCHEDULE_OCCURRENCE_HORIZON', None) is None:
+            raise CommandError('Set TINYSCHEDULE_OCCURRENCE_HORIZON to the number of days to materialize.')
+
+        for model in apps.get_models():
+            if issubclass(model, AbstractSchedule):
+                Occurrence.objects.extend_horizon(model)
+                if options['verbosity'] > 1:
+                    self.stdout.write('Extended the occurrence horizon of %s' % model._meta.label)
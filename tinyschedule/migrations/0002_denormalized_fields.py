@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def update_denormalized_fields(apps, schema_editor):
+    # The historical model does not know the recurrence rules, so compute the
+    # new columns on an unsaved instance of the current model.
+    from tinyschedule.models import Schedule as CurrentSchedule, RULE_FIELDS, DENORMALIZED_FIELDS
+
+    Schedule = apps.get_model('tinyschedule', 'Schedule')
+    for row in Schedule.objects.values_list('pk', *RULE_FIELDS).iterator():
+        schedule = CurrentSchedule(**dict(zip(RULE_FIELDS, row[1:])))
+        schedule.update_denormalized_fields()
+        Schedule.objects.filter(pk=row[0]).update(
+            **dict((field, getattr(schedule, field)) for field in DENORMALIZED_FIELDS))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tinyschedule', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedule',
+            name='last_occurrence_date',
+            field=models.DateField(null=True, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='schedule',
+            name='period',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='schedule',
+            name='weekday_mask',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['repeat_type', 'start_date', 'last_occurrence_date'],
+                               name='tinyschedul_repeat__7492e0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='schedule',
+            index=models.Index(fields=['last_occurrence_date', 'start_date'],
+                               name='tinyschedul_last_oc_9f93e0_idx'),
+        ),
+        migrations.RunPython(update_denormalized_fields, migrations.RunPython.noop),
+    ]
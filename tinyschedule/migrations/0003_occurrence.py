@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('tinyschedule', '0002_denormalized_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Occurrence',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('object_id', models.PositiveIntegerField()),
+                ('date', models.DateField()),
+                ('index', models.PositiveIntegerField()),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                   to='contenttypes.ContentType')),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['content_type', 'date'], name='tinyschedul_content_1e1f54_idx'),
+                    models.Index(fields=['content_type', 'object_id', 'date'], name='tinyschedul_content_15e9ad_idx'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='OccurrenceHorizon',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('content_type', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE,
+                                                      to='contenttypes.ContentType')),
+            ],
+        ),
+    ]
@@ -1,132 +1,422 @@
 from __future__ import unicode_literals
-from django.db import models
-from django.db.models import Q
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import ExtractDay, ExtractMonth, ExtractYear
+from django.db.models.lookups import Exact, GreaterThan, In
 from django.utils import formats
 from django.template.defaultfilters import pluralize
 from django.contrib.humanize.templatetags.humanize import ordinal, apnumber
 
+from .cache import occurrence_cache, lookup_cache
+from .instrumentation import LookupMetrics
+from .sql import Ordinal, SQLOccurrences
+from .spec import RULE_FIELDS, RecurrenceMixin, ScheduleSpec, expand_rules, count_per_day
+# The rules used to live here, keep importing them from this module working
+from .spec import ScheduleRepeatType, WeekDay, add_month, add_month_based_on_weekday  # noqa: F401
+
+from concurrent.futures import ProcessPoolExecutor
+import calendar
+import collections
 import datetime
+import heapq
+import itertools
+import multiprocessing
+import os
 import six
 
 
-class ScheduleRepeatType(object):
-    NONE = 'none'
-    DAILY = 'daily'
-    WEEKLY = 'weekly'
-    MONTHLY = 'monthly'
-    YEARLY = 'yearly'
-
-    choices = (
-        (NONE, 'None'),
-        (DAILY, 'Daily'),
-        (WEEKLY, 'Weekly'),
-        (MONTHLY, 'Monthly'),
-        (YEARLY, 'Yearly'),
+DENORMALIZED_FIELDS = (
+    'last_occurrence_date',
+    'weekday_mask',
+    'period',
+)
+
+
+def days_in_month(year, month):
+    """
+    The number of days in ``month`` of ``year``, as a database expression.
+    """
+    leap_year = Q(Exact(year % 4, 0), ~Q(Exact(year % 100, 0))) | Q(Exact(year % 400, 0))
+    return Case(
+        When(In(month, [4, 6, 9, 11]), then=Value(30)),
+        When(Q(Exact(month, 2)) & leap_year, then=Value(29)),
+        When(Exact(month, 2), then=Value(28)),
+        default=Value(31),
+        output_field=models.IntegerField(),
     )
 
-    choices_dict = dict(choices)
 
-    pluralized_instances = (
-        (DAILY, 'day,days'),
-        (WEEKLY, 'week,weeks'),
-        (MONTHLY, 'month,months'),
-        (YEARLY, 'year,years'),
-    )
-
-    pluralized_instances_dict = dict(pluralized_instances)
-
-
-class WeekDay(object):
-    MONDAY = 'monday'
-    TUESDAY = 'tuesday'
-    WEDNESDAY = 'wednesday'
-    THURSDAY = 'thursday'
-    FRIDAY = 'friday'
-    SATURDAY = 'saturday'
-    SUNDAY = 'sunday'
-
-    choices = (
-        (MONDAY, 'monday'),
-        (TUESDAY, 'tuesday'),
-        (WEDNESDAY, 'wednesday'),
-        (THURSDAY, 'thursday'),
-        (FRIDAY, 'friday'),
-        (SATURDAY, 'saturday'),
-        (SUNDAY, 'sunday'),
-    )
-
-    choices_dict = dict(choices)
+class ScheduleQuerySet(models.QuerySet):
+    def occurring_on(self, date):
+        """
+        Filter the schedules with an occurrence on ``date``. The recurrence
+        rules are tested by the database, so this combines with any other
+        filter, ordering or pagination:
+
+        * daily: the days since ``start_date`` are a multiple of the period.
+        * weekly: the weekday is selected (or is the weekday of
+          ``start_date`` when none are) in a week that is a multiple of the
+          period away.
+        * monthly and yearly: the day and month match, in a month or year
+          that is a multiple of the period away. Schedules on a day that
+          ``date``'s month does not have never match, like in Python; a
+          yearly schedule on February 29 matches February 28 otherwise.
+        * monthly based on weekday: the weekday and the week of the month
+          (or the last week) match.
+
+        The end conditions are checked with ``last_occurrence_date``.
+        """
+        weekday = date.weekday()
+        date_month = date.year * 12 + date.month - 1
+        is_last_week = date.day + 7 > calendar.monthrange(date.year, date.month)[1]
+
+        start_year, start_month, start_day = (
+            ExtractYear('start_date'), ExtractMonth('start_date'), ExtractDay('start_date'))
+        days = Value(date.toordinal()) - Ordinal('start_date')
+        months = Value(date_month) - (start_year * 12 + start_month - 1)
+        start_is_last_week = GreaterThan(start_day + 7, days_in_month(start_year, start_month))
+
+        # The weekday of start_date is used when no weekday is selected
+        weekdays = Q(**{WeekDay.choices[weekday][0]: True}) | Q(Exact(days % 7, 0), weekday_mask=0)
+        # Weeks start on the Monday of the week of start_date
+        weeks = (days + (Ordinal('start_date') - 1) % 7) / 7
+
+        if is_last_week:
+            week_of_month = Q(start_is_last_week) | Q(Exact((start_day - 1) / 7, (date.day - 1) // 7))
+        else:
+            week_of_month = ~Q(start_is_last_week) & Q(Exact((start_day - 1) / 7, (date.day - 1) // 7))
 
+        if (date.month, date.day) == (2, 28) and not calendar.isleap(date.year):
+            yearly_day = Q(In(start_day, [28, 29]))
+        else:
+            yearly_day = Q(Exact(start_day, date.day))
+
+        rules = (
+            Q(repeat_type=ScheduleRepeatType.NONE, start_date=date) |
+            Q(Exact(days % F('repeat_every'), 0), repeat_type=ScheduleRepeatType.DAILY) |
+            Q(Q(start_date=date) | (Q(Exact(weeks % F('repeat_every'), 0)) & weekdays),
+              repeat_type=ScheduleRepeatType.WEEKLY) |
+            Q(Exact(months % F('repeat_every'), 0), Exact(start_day, date.day),
+              repeat_type=ScheduleRepeatType.MONTHLY, monthly_is_based_on_weekday=False) |
+            Q(Exact(months % F('repeat_every'), 0), Exact(days % 7, 0), week_of_month,
+              repeat_type=ScheduleRepeatType.MONTHLY, monthly_is_based_on_weekday=True) |
+            Q(Exact((Value(date.year) - start_year) % F('repeat_every'), 0), Exact(start_month, date.month),
+              yearly_day, repeat_type=ScheduleRepeatType.YEARLY)
+        )
+        return self.filter(
+            Q(last_occurrence_date__isnull=True) | Q(last_occurrence_date__gte=date),
+            rules,
+            start_date__lte=date,
+        )
+
+    def occurrences(self, start, end):
+        """
+        The occurrences of these schedules between ``start`` and ``end``
+        (both inclusive) as a ``SQLOccurrences``, expanded inside the
+        database by a recursive CTE. Its ``as_sql()`` gives ``(sql,
+        params)`` of ``(schedule_id, date, index)`` rows to join and
+        aggregate in raw SQL, iterating it yields the rows. It is not a
+        queryset, so it cannot be used with ``annotate()`` or
+        ``aggregate()``. Supported on SQLite and PostgreSQL.
+        """
+        return SQLOccurrences(self.model._default_manager._lookup_queryset(start, end, self), start, end)
 
-def add_month(date, override_day=0):
-    date_day = date.day if override_day == 0 else override_day
-    if date.month == 12:
-        return datetime.date(date.year + 1, 1, date_day)
-    else:
-        return datetime.date(date.year, date.month + 1, date_day)
+    def find_collisions(self, start=None, end=None, limit=1):
+        """
+        Yield ``(schedule, other, dates)`` for every pair of these schedules
+        that occur on a common date between ``start`` and ``end``, where
+        ``dates`` are the first ``limit`` common dates. Only pairs of
+        schedules whose lifetimes overlap are compared, with ``intersect``.
+        """
+        schedules = self.model._default_manager._lookup_queryset(
+            start or datetime.date.min, end or datetime.date.max, self)
+        active = []
+        for schedule in schedules.order_by('start_date', 'pk'):
+            # Schedules are sorted by start date, so the ones that ended
+            # before this one started can not collide with any later one.
+            active = [other for other in active
+                      if other.last_occurrence_date is None or other.last_occurrence_date >= schedule.start_date]
+            for other in active:
+                dates = list(other.intersect(schedule, start, end, limit))
+                if dates:
+                    yield other, schedule, dates
+            active.append(schedule)
+
+
+class ScheduleManager(models.Manager.from_queryset(ScheduleQuerySet)):
+    def _lookup_queryset(self, date, end_date, schedules_queryset=None):
+        """
+        Narrow ``schedules_queryset`` down to the schedules that can occur
+        between ``date`` and ``end_date``. The queryset of the caller is only
+        filtered, never evaluated.
+        """
+        if schedules_queryset is None:
+            schedules_queryset = self.all()
+        return schedules_queryset.filter(
+            Q(last_occurrence_date__isnull=True) | Q(last_occurrence_date__gte=date),
+            start_date__lte=end_date,
+        ).exclude(
+            repeat_type=ScheduleRepeatType.NONE,
+            start_date__lt=date,
+        )
+
+    def _expand(self, schedules, date, end_date):
+        return [(occurrence, schedule, index)
+                for schedule in schedules
+                for occurrence, index in schedule._occurrences_between(date, end_date)]
+
+    def _occurrences_of(self, schedule, date, end_date, metrics=None):
+        occurrences = schedule._occurrences_between(date, end_date)
+        if metrics is not None:
+            occurrences = metrics.track(schedule, date, occurrences)
+        return occurrences
+
+    def _merge_occurrences(self, schedules, date, end_date, metrics=None):
+        """
+        Merge the occurrences of ``schedules`` in chronological order. Only
+        the next occurrence of every schedule is kept in memory.
+        """
+        heap = []
+        for position, schedule in enumerate(schedules):
+            occurrences = self._occurrences_of(schedule, date, end_date, metrics)
+            for occurrence, index in occurrences:
+                heap.append((occurrence, position, index, schedule, occurrences))
+                break
+        heapq.heapify(heap)
+
+        while heap:
+            occurrence, position, index, schedule, occurrences = heap[0]
+            yield occurrence, schedule, index
+            for occurrence, index in occurrences:
+                heapq.heapreplace(heap, (occurrence, position, index, schedule, occurrences))
+                break
+            else:
+                heapq.heappop(heap)
+
+    def lookup(self, date, end_date=None, schedules_queryset=None, materialized=False, ordered=False, limit=None,
+               cached=False):
+        """
+        Yield ``(occurrence, schedule, index)`` for every occurrence between
+        ``date`` and ``end_date`` (both inclusive). Exactly one query is
+        issued, after which each schedule seeks straight to the window.
 
+        With ``ordered=True``, the occurrences of all schedules are merged in
+        chronological order. ``limit`` stops the lookup after that many
+        occurrences, which makes ``ordered=True, limit=20`` a cheap way to get
+        the next 20 occurrences of a wide window.
 
-def add_month_based_on_weekday(date):
-    # Is the weekday of this date the last one?
-    is_last_weekday = (date + datetime.timedelta(weeks=1)).month != date.month
+        With ``materialized=True``, a window within the occurrence horizon is
+        read from the ``Occurrence`` table instead, ordered by date.
 
-    # Some magic which pushes and pulls some weeks until
-    # it fits right.
-    new_date = date + datetime.timedelta(weeks=4)
-    if (new_date.day + 6) // 7 < (date.day + 6) // 7:
-        new_date += datetime.timedelta(weeks=1)
-    next_month = add_month(date, override_day=1)
-    if new_date.month == (next_month.month - 1 if next_month.month > 1 else 12):
-        new_date += datetime.timedelta(weeks=1)
-    elif new_date.month == (next_month.month + 1 if next_month.month < 12 else 1):
-        new_date += datetime.timedelta(weeks=-1)
+        With ``cached=True``, the result is kept in the Django cache until a
+        schedule of this model is saved or deleted. On a hit, the schedules
+        are fetched with a single ``in_bulk()`` query.
 
-    # If the weekdate of the original date was the last one,
-    # and there is some room left, add a week extra so this
-    # will result in a last weekday of the month again.
-    if is_last_weekday and (new_date + datetime.timedelta(weeks=1)).month == new_date.month:
-        new_date += datetime.timedelta(weeks=1)
+        Every lookup is measured and reported through the
+        ``tinyschedule.instrumentation.lookup_finished`` signal when it has
+        receivers or ``TINYSCHEDULE_SLOW_LOOKUP_THRESHOLD`` is set.
+        """
+        end_date = end_date or date
+        metrics = LookupMetrics.begin(self.model, 'lookup', date, end_date)
+        occurrences = self._lookup(date, end_date, schedules_queryset, materialized, ordered, limit, cached, metrics)
+        if metrics is None:
+            return occurrences
+        return metrics.measure(occurrences, connections[self.db])
+
+    def _lookup(self, date, end_date, schedules_queryset, materialized, ordered, limit, cached, metrics):
+        if cached:
+            key = lookup_cache.key(self.model, schedules_queryset, date, end_date, materialized, ordered, limit)
+            occurrences = lookup_cache.get(key)
+            if occurrences is None:
+                occurrences = list(self._lookup(
+                    date, end_date, schedules_queryset, materialized, ordered, limit, False, metrics))
+                lookup_cache.set(key, [(occurrence, schedule.pk, index) for occurrence, schedule, index in occurrences])
+            else:
+                schedules = self.model._default_manager.in_bulk(set(pk for occurrence, pk, index in occurrences))
+                occurrences = [(occurrence, schedules[pk], index)
+                               for occurrence, pk, index in occurrences if pk in schedules]
+            for occurrence_tuple in occurrences:
+                yield occurrence_tuple
+            return
+
+        occurrences = None
+        if materialized:
+            occurrences = Occurrence.objects.lookup(self.model, date, end_date, schedules_queryset, limit)
+        if occurrences is None:
+            schedules = self._lookup_queryset(date, end_date, schedules_queryset)
+            if ordered:
+                occurrences = self._merge_occurrences(schedules, date, end_date, metrics)
+            else:
+                occurrences = (
+                    (occurrence, schedule, index)
+                    for schedule in schedules
+                    for occurrence, index in self._occurrences_of(schedule, date, end_date, metrics))
+
+        for occurrence_tuple in itertools.islice(occurrences, limit):
+            yield occurrence_tuple
+
+    def count_by_schedule(self, start, end, schedules_queryset=None, chunk_size=2000):
+        """
+        Count the occurrences of every schedule between ``start`` and
+        ``end`` (both inclusive). Gives a dictionary of primary keys to
+        counts, schedules that do not occur are left out. Only the rule
+        columns are read and every count is computed in constant time, no
+        occurrences or model instances are created.
+        """
+        counts = {}
+        rows = self._lookup_queryset(start, end, schedules_queryset) \
+            .values_list('pk', *RULE_FIELDS).iterator(chunk_size=chunk_size)
+        for row in rows:
+            count = ScheduleSpec(*row[1:]).count_occurrences(start, end)
+            if count:
+                counts[row[0]] = count
+        return counts
+
+    def daily_counts(self, start, end, schedules_queryset=None, chunk_size=2000):
+        """
+        Count how many schedules occur on every day between ``start`` and
+        ``end`` (both inclusive). Gives a list with the count of
+        ``start + i`` at index ``i``. Only the rule columns are read, no
+        occurrences or model instances are created.
+        """
+        rows = self._lookup_queryset(start, end, schedules_queryset) \
+            .values_list(*RULE_FIELDS).iterator(chunk_size=chunk_size)
+        return count_per_day((ScheduleSpec(*row) for row in rows), start, end)
 
-    return new_date
+    def to_bitmaps(self, start, end, schedules_queryset=None, chunk_size=2000):
+        """
+        Give the occurrences of every schedule between ``start`` and ``end``
+        as a dictionary of primary keys to ``Bitmap``, reading only the rule
+        columns. Schedules that do not occur are left out.
+        """
+        bitmaps = {}
+        rows = self._lookup_queryset(start, end, schedules_queryset) \
+            .values_list('pk', *RULE_FIELDS).iterator(chunk_size=chunk_size)
+        for row in rows:
+            bitmap = ScheduleSpec(*row[1:]).to_bitmap(start, end)
+            if bitmap:
+                bitmaps[row[0]] = bitmap
+        return bitmaps
+
+    def occurrences(self, start, end, schedules_queryset=None):
+        """
+        Like ``ScheduleQuerySet.occurrences``, for the schedules in
+        ``schedules_queryset`` or all of them.
+        """
+        if schedules_queryset is None:
+            schedules_queryset = self.all()
+        return SQLOccurrences(self._lookup_queryset(start, end, schedules_queryset), start, end)
 
+    def find_collisions(self, schedules_queryset=None, start=None, end=None, limit=1):
+        """
+        Like ``ScheduleQuerySet.find_collisions``, for the schedules in
+        ``schedules_queryset`` or all of them.
+        """
+        if schedules_queryset is None:
+            schedules_queryset = self.all()
+        return schedules_queryset.find_collisions(start, end, limit)
 
-class ScheduleManager(models.Manager):
-    def lookup(self, date, end_date=None, schedules_queryset=None):
+    def stream_lookup(self, date, end_date=None, schedules_queryset=None, chunk_size=2000, hydrate=False):
+        """
+        Like ``lookup``, but for very large sets of schedules. Only the rule
+        columns are read, through ``iterator(chunk_size=...)`` (a server-side
+        cursor where the database supports it), and ``(occurrence, pk,
+        index)`` is yielded. With ``hydrate=True`` the schedules themselves
+        are yielded instead of their primary keys, fetched with one
+        ``in_bulk()`` query per chunk. Memory is bounded by the chunk size.
+        """
         end_date = end_date or date
-        schedules_queryset = schedules_queryset or self.all()
-        for schedule in schedules_queryset.filter(
-            start_date__gte=date,
-            end_date__isnull=True,
-            repeat_type=ScheduleRepeatType.NONE
-            ).filter(start_date__lte=end_date):
-            yield schedule.start_date, schedule, 0
-
-        def check_repeating_patterns(schedules):
-            for schedule in schedules:
-                for i, occurrence in enumerate(schedule.iterate_occurrences(end_date)):
-                    if occurrence >= date:
-                        yield occurrence, schedule, i
-
-        for schedule_pair in check_repeating_patterns(
-                schedules_queryset.filter(
-                    (Q(start_date__lte=date) | Q(start_date__lte=end_date))
-                    &
-                    (Q(end_date__gte=date) | Q(end_date__gte=end_date))
-                ).exclude(repeat_type=ScheduleRepeatType.NONE)
-            ):
-            yield schedule_pair
-
-        for schedule_pair in check_repeating_patterns(
-                schedules_queryset.filter(
-                    Q(start_date__lte=date) | Q(start_date__lte=end_date)
-                ).filter(
-                    end_date__isnull=True,
-                ).exclude(repeat_type=ScheduleRepeatType.NONE)
-            ):
-            yield schedule_pair
+        rows = self._lookup_queryset(date, end_date, schedules_queryset) \
+            .values_list('pk', *RULE_FIELDS).iterator(chunk_size=chunk_size)
+        for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+            if hydrate:
+                schedules = self.model._default_manager.in_bulk([row[0] for row in chunk])
+            for row in chunk:
+                rule = ScheduleSpec(*row[1:])
+                schedule = schedules[row[0]] if hydrate else row[0]
+                for occurrence, index in rule._occurrences_between(date, end_date):
+                    yield occurrence, schedule, index
+
+    def parallel_lookup(self, date, end_date=None, schedules_queryset=None, workers=None, chunk_size=5000,
+                        ordered=False, mp_context=None):
+        """
+        Like ``lookup``, but the schedules are expanded by ``workers``
+        processes (one per CPU by default). The rules are read in ranges of
+        ``chunk_size`` primary keys and sent to the workers as plain tuples,
+        the schedules of each range are fetched with one ``in_bulk()`` query.
+
+        The output is exactly the output of ``lookup`` over the schedules
+        ordered by primary key, with or without ``ordered=True``. Workers are
+        spawned rather than forked (unless ``mp_context`` says otherwise), so
+        they never share a database connection.
+        """
+        end_date = end_date or date
+        workers = workers or os.cpu_count() or 1
+        rows = self._lookup_queryset(date, end_date, schedules_queryset).order_by('pk') \
+            .values_list('pk', *RULE_FIELDS).iterator(chunk_size=chunk_size)
+
+        runs = []
+        dates = {}
+
+        def collect(future):
+            # Give the occurrences of a finished chunk with their schedules,
+            # or keep them for the merge when the output is ordered.
+            occurrences = future.result()
+            schedules = self.model._default_manager.in_bulk(set(pk for day, pk, index in occurrences))
+            for day, pk, index in occurrences:
+                if day not in dates:
+                    dates[day] = datetime.date.fromordinal(day)
+            occurrences = [(dates[day], pk, index, schedules[pk]) for day, pk, index in occurrences]
+            if ordered:
+                runs.append(occurrences)
+                return []
+            return occurrences
+
+        with ProcessPoolExecutor(workers, mp_context=mp_context or multiprocessing.get_context('spawn')) as executor:
+            # Keep a couple of chunks per worker in flight, not the whole queryset
+            pending = collections.deque()
+            for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+                pending.append(executor.submit(expand_rules, chunk, date, end_date, ordered))
+                while len(pending) > 2 * workers or (pending and pending[0].done()):
+                    for occurrence, pk, index, schedule in collect(pending.popleft()):
+                        yield occurrence, schedule, index
+            while pending:
+                for occurrence, pk, index, schedule in collect(pending.popleft()):
+                    yield occurrence, schedule, index
+
+        # Every run is sorted by date and primary key, merge them
+        for occurrence, pk, index, schedule in heapq.merge(*runs):
+            yield occurrence, schedule, index
+
+    async def alookup(self, date, end_date=None, schedules_queryset=None, chunk_size=500):
+        """
+        Asynchronous version of ``lookup``. The schedules are fetched with
+        asynchronous iteration and expanded in a worker thread, a chunk of
+        ``chunk_size`` schedules at a time, so the event loop is never
+        blocked by a large expansion. ``ordered``, ``limit``, ``cached``
+        and ``materialized`` are not supported.
+        """
+        end_date = end_date or date
+        chunk = []
+        schedules = self._lookup_queryset(date, end_date, schedules_queryset)
+        async for schedule in schedules.aiterator(chunk_size=chunk_size):
+            chunk.append(schedule)
+            if len(chunk) == chunk_size:
+                for occurrence_tuple in await sync_to_async(self._expand, thread_sensitive=False)(
+                        chunk, date, end_date):
+                    yield occurrence_tuple
+                chunk = []
+        if chunk:
+            for occurrence_tuple in await sync_to_async(self._expand, thread_sensitive=False)(chunk, date, end_date):
+                yield occurrence_tuple
+
 
 @six.python_2_unicode_compatible
-class AbstractSchedule(models.Model):
+class AbstractSchedule(RecurrenceMixin, models.Model):
     start_date = models.DateField(default=datetime.datetime.now)
     end_date = models.DateField(blank=True, null=True)
     end_after_occurrences = models.PositiveIntegerField(default=0)
@@ -141,10 +431,59 @@ class AbstractSchedule(models.Model):
     saturday = models.BooleanField(blank=True, default=False)
     sunday = models.BooleanField(blank=True, default=False)
 
+    # Denormalized from the fields above on every save, so that the database
+    # can prune schedules. ``last_occurrence_date`` is empty when a schedule
+    # repeats forever, ``period`` is in days for daily and weekly schedules
+    # and in months for monthly and yearly schedules.
+    last_occurrence_date = models.DateField(blank=True, null=True, editable=False)
+    weekday_mask = models.PositiveSmallIntegerField(default=0, editable=False)
+    period = models.PositiveIntegerField(default=0, editable=False)
+
     objects = ScheduleManager()
 
     class Meta:
         abstract = True
+        indexes = [
+            models.Index(fields=['repeat_type', 'start_date', 'last_occurrence_date']),
+            models.Index(fields=['last_occurrence_date', 'start_date']),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Drop the runs of the rule this schedule had when they were cached
+        if getattr(self, '_cached_fingerprint', None) is not None:
+            occurrence_cache.invalidate(self._cached_fingerprint)
+            self._cached_fingerprint = None
+        self.update_denormalized_fields()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | set(DENORMALIZED_FIELDS)
+        super(AbstractSchedule, self).save(*args, **kwargs)
+
+    def update_denormalized_fields(self):
+        """
+        Compute ``last_occurrence_date``, ``weekday_mask`` and ``period``
+        from the rule fields. This happens on every ``save()``; call it
+        yourself before a ``bulk_create()``.
+        """
+        self.start_date = self._meta.get_field('start_date').to_python(self.start_date)
+        self.end_date = self._meta.get_field('end_date').to_python(self.end_date)
+
+        count = self._occurrence_count()
+        if count is None:
+            self.last_occurrence_date = None
+        elif count > 0:
+            self.last_occurrence_date = self._occurrence(count - 1)
+        else:
+            # Ends before it starts
+            self.last_occurrence_date = self.end_date
+
+        self.weekday_mask = self._selected_weekday_bits()
+
+        self.period = self.repeat_every * {
+            ScheduleRepeatType.DAILY: 1,
+            ScheduleRepeatType.WEEKLY: 7,
+            ScheduleRepeatType.MONTHLY: 1,
+            ScheduleRepeatType.YEARLY: 12,
+        }.get(self.repeat_type, 0)
 
     @property
     def humanized_weekdays(self):
@@ -191,60 +530,147 @@ class AbstractSchedule(models.Model):
     def __str__(self):
         return ' '.join(self._description_builder())
 
+    def occurrences_between(self, start, end=None):
+        """
+        Like ``RecurrenceMixin.occurrences_between``, but bounded runs are
+        kept in the process-local occurrence cache, so asking for the same
+        run again does not expand it again. Runs without an ``end`` or longer
+        than ``occurrence_cache.max_run`` are streamed instead.
+        """
+        if not occurrence_cache.maxsize or end is None or \
+                self.count_occurrences(start, end) > occurrence_cache.max_run:
+            return self._occurrences_between(start, end)
+
+        self._cached_fingerprint = self.rule_fingerprint
+        key = (self._cached_fingerprint, start, end)
+        run = occurrence_cache.get(key)
+        if run is None:
+            run = tuple(self._occurrences_between(start, end))
+            occurrence_cache.set(key, run)
+        return iter(run)
+
     def iterate_occurrences(self, end_date=None):
-        occurrences = 0
-        current = self.start_date
-        while (end_date is None or current <= end_date) and \
-            (not self.end_date or current <= self.end_date) and \
-            (self.end_after_occurrences == 0 or occurrences < self.end_after_occurrences):
-            occurrences += 1
-            yield current
-            current = self.next_date(current)
-
-    def __getitem__(self, item):
-        if not isinstance(item, six.string_types):
-            for i, occurrence in enumerate(self.iterate_occurrences()):
-                if item == i:
-                    return occurrence
-        else:
-            return super(AbstractSchedule, self).__getitem__(item)
-
-    def next_date(self, date):
-        """
-        Based on this schedule, give the next valid date after ``date``.
-        It is only guaranteed that the resulting next date is valid when the
-        given ``date`` is already valid.
-        """
-        if self.repeat_type == ScheduleRepeatType.DAILY:
-            return date + datetime.timedelta(days=self.repeat_every)
-        elif self.repeat_type == ScheduleRepeatType.WEEKLY:
-            current = date
-            for i in range(7):
-                current = current + datetime.timedelta(days=1)
-                if current.weekday() == 0:
-                    # When we arrive on Monday, skip some weeks if needed.
-                    current = current + datetime.timedelta(days=7 * (self.repeat_every - 1))
-                if getattr(self, WeekDay.choices[current.weekday()][0]):
-                    return current
-        elif self.repeat_type == ScheduleRepeatType.MONTHLY:
-            current = date
-            for i in range(self.repeat_every):
-                # FIXME: catch ValueError and ignore bad months. Works like Google Calendar
-                current = add_month_based_on_weekday(current) \
-                    if self.monthly_is_based_on_weekday \
-                    else add_month(current)
-            return current
-        elif self.repeat_type == ScheduleRepeatType.YEARLY:
-            try:
-                return datetime.date(date.year + self.repeat_every,
-                                     self.start_date.month,
-                                     self.start_date.day)
-            except ValueError:
-                assert self.start_date.day == 29 and self.start_date.month == 2
-                return datetime.date(date.year + self.repeat_every, 2, 28)
-
-        raise ValueError('repeat_type "%s" is not supported' % self.repeat_type)
+        metrics = LookupMetrics.begin(type(self), 'iterate_occurrences', self.start_date, end_date)
+        if metrics is None:
+            return super(AbstractSchedule, self).iterate_occurrences(end_date)
+        occurrences = metrics.track(self, self.start_date, self.occurrences_between(self.start_date, end_date))
+        return metrics.measure(occurrence for occurrence, index in occurrences)
+
+    def to_spec(self):
+        """
+        Give the rule of this schedule as a ``ScheduleSpec``.
+        """
+        return ScheduleSpec(*self.rule_fingerprint)
 
 
 class Schedule(AbstractSchedule):
     pass
+
+
+class OccurrenceManager(models.Manager):
+    def materialize(self, schedule, start, end):
+        """
+        Replace the materialized occurrences of ``schedule`` between
+        ``start`` and ``end``.
+        """
+        content_type = ContentType.objects.get_for_model(schedule)
+        with transaction.atomic():
+            self.filter(content_type=content_type, object_id=schedule.pk, date__range=(start, end)).delete()
+            self.bulk_create([
+                self.model(content_type=content_type, object_id=schedule.pk, date=occurrence, index=index)
+                for occurrence, index in schedule.occurrences_between(start, end)])
+
+    def extend_horizon(self, schedule_model, today=None):
+        """
+        Move the occurrence horizon of ``schedule_model`` to the next
+        ``TINYSCHEDULE_OCCURRENCE_HORIZON`` days from ``today``. Only the days
+        which were not materialized yet are expanded, and the occurrences
+        before ``today`` are dropped.
+        """
+        today = today or datetime.date.today()
+        end = today + datetime.timedelta(days=settings.TINYSCHEDULE_OCCURRENCE_HORIZON)
+        content_type = ContentType.objects.get_for_model(schedule_model)
+        horizon = OccurrenceHorizon.objects.filter(content_type=content_type).first()
+        if horizon is None or horizon.end_date < today:
+            # Nothing materialized is left to reuse, start the window over
+            start = today
+            horizon = horizon or OccurrenceHorizon(content_type=content_type)
+        else:
+            start = max(today, horizon.end_date + datetime.timedelta(days=1))
+
+        with transaction.atomic():
+            self.filter(content_type=content_type).exclude(date__range=(today, end)).delete()
+            if start <= end:
+                self.bulk_create((
+                    self.model(content_type=content_type, object_id=schedule.pk, date=occurrence, index=index)
+                    for occurrence, schedule, index in schedule_model.objects.lookup(start, end)
+                ), batch_size=1000)
+            horizon.start_date = today
+            horizon.end_date = end
+            horizon.save()
+
+    def lookup(self, schedule_model, date, end_date, schedules_queryset=None, limit=None):
+        """
+        Give the materialized ``(occurrence, schedule, index)`` tuples
+        between ``date`` and ``end_date`` ordered by date, or ``None`` when
+        that window is not within the occurrence horizon.
+        """
+        content_type = ContentType.objects.get_for_model(schedule_model)
+        if not OccurrenceHorizon.objects.filter(
+                content_type=content_type, start_date__lte=date, end_date__gte=end_date).exists():
+            return None
+
+        occurrences = self.filter(content_type=content_type, date__range=(date, end_date))
+        if schedules_queryset is not None:
+            occurrences = occurrences.filter(object_id__in=schedules_queryset.values('pk'))
+        occurrences = occurrences.order_by('date', 'object_id').values_list('date', 'object_id', 'index')
+        occurrences = list(occurrences[:limit] if limit is not None else occurrences)
+        schedules = schedule_model._default_manager.in_bulk(set(object_id for date, object_id, index in occurrences))
+        return [(occurrence, schedules[object_id], index) for occurrence, object_id, index in occurrences]
+
+
+class Occurrence(models.Model):
+    """
+    An occurrence of any kind of schedule, materialized within the rolling
+    horizon set by ``TINYSCHEDULE_OCCURRENCE_HORIZON``.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    schedule = GenericForeignKey('content_type', 'object_id')
+    date = models.DateField()
+    index = models.PositiveIntegerField()
+
+    objects = OccurrenceManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['content_type', 'date']),
+            models.Index(fields=['content_type', 'object_id', 'date']),
+        ]
+
+
+class OccurrenceHorizon(models.Model):
+    """
+    The window in which the occurrences of a kind of schedule are
+    materialized.
+    """
+    content_type = models.OneToOneField(ContentType, on_delete=models.CASCADE)
+    start_date = models.DateField()
+    end_date = models.DateField()
+
+
+class DispatchCheckpoint(models.Model):
+    """
+    The last occurrence of a schedule that was fired by a
+    ``tinyschedule.dispatcher.Dispatcher``, so a restarted dispatcher does not
+    fire it again.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    schedule = GenericForeignKey('content_type', 'object_id')
+    date = models.DateField()
+    index = models.PositiveIntegerField()
+    fired_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = [('content_type', 'object_id')]
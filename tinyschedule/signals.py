@@ -0,0 +1,38 @@
+from __future__ import unicode_literals
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import lookup_cache
+from .models import AbstractSchedule, Occurrence, OccurrenceHorizon
+
+
+def is_materialized(instance):
+    return isinstance(instance, AbstractSchedule) and \
+        getattr(settings, 'TINYSCHEDULE_OCCURRENCE_HORIZON', None) is not None
+
+
+@receiver(post_save)
+def materialize_occurrences(sender, instance, raw=False, **kwargs):
+    if raw or not is_materialized(instance):
+        return
+    horizon = OccurrenceHorizon.objects.filter(content_type=ContentType.objects.get_for_model(instance)).first()
+    if horizon is not None:
+        Occurrence.objects.materialize(instance, horizon.start_date, horizon.end_date)
+
+
+@receiver(post_delete)
+def delete_occurrences(sender, instance, **kwargs):
+    if not is_materialized(instance):
+        return
+    Occurrence.objects.filter(
+        content_type=ContentType.objects.get_for_model(instance),
+        object_id=instance.pk).delete()
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def bump_lookup_generation(sender, instance, **kwargs):
+    if isinstance(instance, AbstractSchedule):
+        lookup_cache.bump_generation(sender)
@@ -0,0 +1,896 @@
+"""
+The recurrence rules of schedules, without Django.
+
+``ScheduleSpec`` is a small immutable value which carries the rule fields of a
+schedule and evaluates them with the same code as ``AbstractSchedule``, so it
+can be used in processes which do not configure Django. Model instances give
+one with ``to_spec()``.
+"""
+from __future__ import unicode_literals
+
+from .bitmap import Bitmap, stride_bits
+
+import bisect
+import calendar
+import datetime
+import heapq
+import itertools
+import operator
+from six.moves import range
+
+try:
+    from math import gcd
+except ImportError:
+    from fractions import gcd
+
+
+# The fields which define the recurrence of a schedule
+RULE_FIELDS = (
+    'start_date',
+    'end_date',
+    'end_after_occurrences',
+    'repeat_type',
+    'repeat_every',
+    'monthly_is_based_on_weekday',
+    'monday',
+    'tuesday',
+    'wednesday',
+    'thursday',
+    'friday',
+    'saturday',
+    'sunday',
+)
+
+
+class ScheduleRepeatType(object):
+    NONE = 'none'
+    DAILY = 'daily'
+    WEEKLY = 'weekly'
+    MONTHLY = 'monthly'
+    YEARLY = 'yearly'
+
+    choices = (
+        (NONE, 'None'),
+        (DAILY, 'Daily'),
+        (WEEKLY, 'Weekly'),
+        (MONTHLY, 'Monthly'),
+        (YEARLY, 'Yearly'),
+    )
+
+    choices_dict = dict(choices)
+
+    pluralized_instances = (
+        (DAILY, 'day,days'),
+        (WEEKLY, 'week,weeks'),
+        (MONTHLY, 'month,months'),
+        (YEARLY, 'year,years'),
+    )
+
+    pluralized_instances_dict = dict(pluralized_instances)
+
+
+class WeekDay(object):
+    MONDAY = 'monday'
+    TUESDAY = 'tuesday'
+    WEDNESDAY = 'wednesday'
+    THURSDAY = 'thursday'
+    FRIDAY = 'friday'
+    SATURDAY = 'saturday'
+    SUNDAY = 'sunday'
+
+    choices = (
+        (MONDAY, 'monday'),
+        (TUESDAY, 'tuesday'),
+        (WEDNESDAY, 'wednesday'),
+        (THURSDAY, 'thursday'),
+        (FRIDAY, 'friday'),
+        (SATURDAY, 'saturday'),
+        (SUNDAY, 'sunday'),
+    )
+
+    choices_dict = dict(choices)
+
+
+def count_bits(bits):
+    return bin(bits).count('1')
+
+
+def month_index(date):
+    return date.year * 12 + date.month - 1
+
+
+def nth_weekday_of_month(year, month, weekday, nth):
+    """
+    Give the ``nth`` (zero based) ``weekday`` of a month, or the last one
+    when ``nth`` is negative.
+    """
+    if nth < 0:
+        last = datetime.date(year, month, calendar.monthrange(year, month)[1])
+        return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+    first = datetime.date(year, month, 1)
+    return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * nth)
+
+
+# The Gregorian calendar repeats itself every 400 years
+GREGORIAN_CYCLE_DAYS = 146097
+GREGORIAN_CYCLE_MONTHS = 4800
+
+DAYS_BEFORE_MONTH = (0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334, 365)
+
+
+def month_ordinals(month):
+    """
+    Give the ordinal of the first day of the month at ``month`` (as given by
+    ``month_index``) and its number of days, with integer arithmetic only.
+    """
+    year, month = divmod(month, 12)
+    leap = calendar.isleap(year)
+    before = year - 1
+    first = (before * 365 + before // 4 - before // 100 + before // 400 + DAYS_BEFORE_MONTH[month] +
+             (leap and month > 1) + 1)
+    return first, DAYS_BEFORE_MONTH[month + 1] - DAYS_BEFORE_MONTH[month] + (leap and month == 1)
+
+
+_valid_month_offsets_cache = {}
+
+
+def valid_month_offsets(first_month, every, day):
+    """
+    For a schedule on ``day`` (30 or 31) of every ``every`` months starting
+    at month index ``first_month``, give ``(cycle, offsets)``: the validity
+    of the months repeats every ``cycle`` steps, and ``offsets`` are the
+    steps in that cycle that land on a month which actually has ``day``.
+    These only depend on the month of the year, so at most 288 are cached.
+    """
+    key = (first_month % 12, every % 12, day)
+    if key not in _valid_month_offsets_cache:
+        cycle = 12 // gcd(every, 12)
+        offsets = []
+        for step in range(cycle):
+            year, month = divmod(first_month + step * every, 12)
+            if calendar.monthrange(year, month + 1)[1] >= day:
+                offsets.append(step)
+        _valid_month_offsets_cache[key] = cycle, offsets
+    return _valid_month_offsets_cache[key]
+
+
+def count_multiples(first, step, count, modulus):
+    """
+    Count the ``k`` in ``[0, count)`` for which ``first + k * step`` is a
+    multiple of ``modulus``.
+    """
+    divisor = gcd(step, modulus)
+    if first % divisor:
+        return 0
+    reduced = modulus // divisor
+    first_k = -first // divisor * pow(step // divisor, -1, reduced) % reduced
+    return max(0, -(-(count - first_k) // reduced))
+
+
+def count_valid_steps(first_month, every, day, steps):
+    """
+    For a schedule on ``day`` of every ``every`` months starting at month
+    index ``first_month``, count the steps in ``[0, steps)`` that land on a
+    month which actually has ``day``, in constant time.
+    """
+    if day <= 28 or steps <= 0:
+        return max(steps, 0)
+    if day > 29:
+        cycle, offsets = valid_month_offsets(first_month, every, day)
+        return steps // cycle * len(offsets) + bisect.bisect_left(offsets, steps % cycle)
+
+    # Only February of a common year lacks the 29th. The steps that land on
+    # a February are an arithmetic progression, and so are their years.
+    divisor = gcd(every, 12)
+    if (1 - first_month) % divisor:
+        return steps
+    reduced = 12 // divisor
+    first_step = (1 - first_month) // divisor * pow(every // divisor, -1, reduced) % reduced
+    if first_step >= steps:
+        return steps
+    februaries = -(-(steps - first_step) // reduced)
+    first_year, years = (first_month + first_step * every) // 12, reduced * every // 12
+    leap_februaries = (count_multiples(first_year, years, februaries, 4) -
+                       count_multiples(first_year, years, februaries, 100) +
+                       count_multiples(first_year, years, februaries, 400))
+    return steps - februaries + leap_februaries
+
+
+def valid_step(first_month, every, day, index):
+    """
+    The inverse of ``count_valid_steps``: give the step of the valid month
+    at ``index``.
+    """
+    if day <= 28:
+        return index
+    if day > 29:
+        cycle, offsets = valid_month_offsets(first_month, every, day)
+        periods, remainder = divmod(index, len(offsets))
+        return periods * cycle + offsets[remainder]
+
+    # The validity of the 29th repeats with the Gregorian cycle, search the
+    # step within one cycle.
+    cycle = GREGORIAN_CYCLE_MONTHS // gcd(every, GREGORIAN_CYCLE_MONTHS)
+    periods, remainder = divmod(index, count_valid_steps(first_month, every, day, cycle))
+    low, high = 0, cycle - 1
+    while low < high:
+        middle = (low + high) // 2
+        if count_valid_steps(first_month, every, day, middle + 1) > remainder:
+            high = middle
+        else:
+            low = middle + 1
+    return periods * cycle + low
+
+
+def lcm(a, b):
+    return a // gcd(a, b) * b
+
+
+def crt(residue, modulus, other_residue, other_modulus):
+    """
+    Solve ``x = residue (mod modulus)`` and ``x = other_residue (mod
+    other_modulus)`` with the Chinese remainder theorem. Gives ``(x, lcm)``
+    with the smallest non-negative ``x``, or ``None`` without a solution.
+    """
+    divisor = gcd(modulus, other_modulus)
+    if (other_residue - residue) % divisor:
+        return None
+    reduced = other_modulus // divisor
+    steps = (other_residue - residue) // divisor * pow(modulus // divisor, -1, reduced) % reduced
+    combined = modulus * reduced
+    return (residue + modulus * steps) % combined, combined
+
+
+def add_month(date, override_day=0):
+    date_day = date.day if override_day == 0 else override_day
+    if date.month == 12:
+        return datetime.date(date.year + 1, 1, date_day)
+    else:
+        return datetime.date(date.year, date.month + 1, date_day)
+
+
+def add_month_based_on_weekday(date):
+    # Is the weekday of this date the last one?
+    is_last_weekday = (date + datetime.timedelta(weeks=1)).month != date.month
+
+    # Some magic which pushes and pulls some weeks until
+    # it fits right.
+    new_date = date + datetime.timedelta(weeks=4)
+    if (new_date.day + 6) // 7 < (date.day + 6) // 7:
+        new_date += datetime.timedelta(weeks=1)
+    next_month = add_month(date, override_day=1)
+    if new_date.month == (next_month.month - 1 if next_month.month > 1 else 12):
+        new_date += datetime.timedelta(weeks=1)
+    elif new_date.month == (next_month.month + 1 if next_month.month < 12 else 1):
+        new_date += datetime.timedelta(weeks=-1)
+
+    # If the weekdate of the original date was the last one,
+    # and there is some room left, add a week extra so this
+    # will result in a last weekday of the month again.
+    if is_last_weekday and (new_date + datetime.timedelta(weeks=1)).month == new_date.month:
+        new_date += datetime.timedelta(weeks=1)
+
+    return new_date
+
+
+class RecurrenceMixin(object):
+    """
+    Evaluates the rule fields (``RULE_FIELDS``) of the class it is mixed
+    into, in constant time per occurrence.
+    """
+    __slots__ = ()
+
+    def _selected_weekday_bits(self):
+        bits = 0
+        for i, (weekday_slug, weekday_name) in enumerate(WeekDay.choices):
+            if getattr(self, weekday_slug):
+                bits |= 1 << i
+        return bits
+
+    @property
+    def _weekday_bits(self):
+        """
+        The weekdays of a weekly schedule as a bitmask, Monday being the
+        lowest bit. Falls back to the weekday of ``start_date`` when no
+        weekday is selected.
+        """
+        return self._selected_weekday_bits() or 1 << self.start_date.weekday()
+
+    def _weekly_position(self, date):
+        """
+        Count the selected weekdays in the active weeks between the Monday
+        of the first week and ``date`` (exclusive).
+        """
+        bits = self._weekday_bits
+        first_monday = self.start_date - datetime.timedelta(days=self.start_date.weekday())
+        weeks, weekday = divmod((date - first_monday).days, 7)
+        position = -(-weeks // self.repeat_every) * count_bits(bits)
+        if weeks % self.repeat_every == 0:
+            position += count_bits(bits & ((1 << weekday) - 1))
+        return position
+
+    def _weekly_date(self, position):
+        """
+        The inverse of ``_weekly_position``: give the date of the selected
+        weekday at ``position``.
+        """
+        bits = self._weekday_bits
+        periods, remainder = divmod(position, count_bits(bits))
+        weekday = 0
+        while True:
+            if bits & (1 << weekday):
+                if remainder == 0:
+                    break
+                remainder -= 1
+            weekday += 1
+        first_monday = self.start_date - datetime.timedelta(days=self.start_date.weekday())
+        return first_monday + datetime.timedelta(weeks=periods * self.repeat_every, days=weekday)
+
+    def _monthly_date(self, index):
+        """
+        Give the occurrence at ``index`` of a monthly schedule, not taking
+        the end conditions into account.
+        """
+        if self.monthly_is_based_on_weekday:
+            year, month = divmod(month_index(self.start_date) + index * self.repeat_every, 12)
+            if year > datetime.MAXYEAR:
+                raise OverflowError('date value out of range')
+            is_last_weekday = (self.start_date + datetime.timedelta(weeks=1)).month != self.start_date.month
+            return nth_weekday_of_month(year, month + 1, self.start_date.weekday(),
+                                        -1 if is_last_weekday else (self.start_date.day - 1) // 7)
+
+        # Months that do not have the day of the start date are skipped, just
+        # like Google Calendar does.
+        step = valid_step(month_index(self.start_date), self.repeat_every, self.start_date.day, index)
+        year, month = divmod(month_index(self.start_date) + step * self.repeat_every, 12)
+        if year > datetime.MAXYEAR:
+            raise OverflowError('date value out of range')
+        return datetime.date(year, month + 1, self.start_date.day)
+
+    def _monthly_count_before(self, date):
+        """
+        Count the occurrences of a monthly schedule before ``date``, not
+        taking the end conditions into account.
+        """
+        steps = max(0, -(-(month_index(date) - month_index(self.start_date)) // self.repeat_every))
+        if self.monthly_is_based_on_weekday:
+            count = steps
+        else:
+            count = count_valid_steps(month_index(self.start_date), self.repeat_every, self.start_date.day, steps)
+        # The first occurrence from the month of ``date`` onwards may still
+        # fall before ``date`` itself.
+        if self._monthly_date(count) < date:
+            count += 1
+        return count
+
+    def _yearly_date(self, index):
+        """
+        Give the occurrence at ``index`` of a yearly schedule. The 29th of
+        February falls back to the 28th in other years.
+        """
+        year = self.start_date.year + index * self.repeat_every
+        if year > datetime.MAXYEAR:
+            raise OverflowError('date value out of range')
+        try:
+            return datetime.date(year, self.start_date.month, self.start_date.day)
+        except ValueError:
+            return datetime.date(year, 2, 28)
+
+    def _occurrence(self, index):
+        """
+        Give the occurrence at ``index`` in constant time, not taking
+        ``end_date`` and ``end_after_occurrences`` into account. Gives
+        ``None`` when the schedule does not repeat, raises ``OverflowError``
+        when the occurrence falls after ``datetime.date.max``.
+        """
+        if index == 0:
+            return self.start_date
+        if self.repeat_type == ScheduleRepeatType.NONE:
+            return None
+        if self.repeat_type == ScheduleRepeatType.DAILY:
+            return self.start_date + datetime.timedelta(days=index * self.repeat_every)
+        if self.repeat_type == ScheduleRepeatType.WEEKLY:
+            # The start date always counts as the first occurrence, even when
+            # its weekday is not selected.
+            position = index + self._weekly_position(self.start_date)
+            if not self._weekday_bits & (1 << self.start_date.weekday()):
+                position -= 1
+            return self._weekly_date(position)
+        if self.repeat_type == ScheduleRepeatType.MONTHLY:
+            return self._monthly_date(index)
+        if self.repeat_type == ScheduleRepeatType.YEARLY:
+            return self._yearly_date(index)
+
+        raise ValueError('repeat_type "%s" is not supported' % self.repeat_type)
+
+    def _count_before(self, date):
+        """
+        Count the occurrences before ``date`` in constant time, not taking
+        ``end_date`` and ``end_after_occurrences`` into account.
+        """
+        if date <= self.start_date:
+            return 0
+        if self.repeat_type == ScheduleRepeatType.NONE:
+            return 1
+        if self.repeat_type == ScheduleRepeatType.DAILY:
+            return -(-(date - self.start_date).days // self.repeat_every)
+        if self.repeat_type == ScheduleRepeatType.WEEKLY:
+            count = self._weekly_position(date) - self._weekly_position(self.start_date)
+            if not self._weekday_bits & (1 << self.start_date.weekday()):
+                count += 1
+            return count
+        if self.repeat_type == ScheduleRepeatType.MONTHLY:
+            return self._monthly_count_before(date)
+        if self.repeat_type == ScheduleRepeatType.YEARLY:
+            count = -(-(date.year - self.start_date.year) // self.repeat_every)
+            if self._yearly_date(count) < date:
+                count += 1
+            return count
+
+        raise ValueError('repeat_type "%s" is not supported' % self.repeat_type)
+
+    def _occurrence_count(self):
+        """
+        Count all occurrences of a finite schedule, or give ``None`` when the
+        schedule repeats forever. A schedule whose last occurrence would fall
+        after ``datetime.date.max`` counts as repeating forever.
+        """
+        count = 1 if self.repeat_type == ScheduleRepeatType.NONE else None
+        if self.end_after_occurrences > 0:
+            count = self.end_after_occurrences if count is None else min(count, self.end_after_occurrences)
+        if self.end_date and self.end_date < datetime.date.max:
+            until_end_date = self._count_before(self.end_date + datetime.timedelta(days=1))
+            count = until_end_date if count is None else min(count, until_end_date)
+        if count:
+            try:
+                self._occurrence(count - 1)
+            except OverflowError:
+                return None
+        return count
+
+    @property
+    def rule_fingerprint(self):
+        """
+        A hashable summary of the fields which define the recurrence.
+        """
+        return tuple(getattr(self, field) for field in RULE_FIELDS)
+
+    def _occurrences_between(self, start, end=None):
+        index = self._count_before(start)
+        count = self._occurrence_count()
+        while count is None or index < count:
+            try:
+                current = self._occurrence(index)
+            except OverflowError:
+                # Repeats forever, but dates end at datetime.date.max
+                break
+            if end is not None and current > end:
+                break
+            yield current, index
+            index += 1
+
+    def occurrences_between(self, start, end=None):
+        """
+        Yield ``(occurrence, index)`` pairs for the occurrences between
+        ``start`` and ``end`` (both inclusive). Instead of replaying the
+        schedule from ``start_date``, this jumps straight to the first
+        occurrence on or after ``start``.
+        """
+        return self._occurrences_between(start, end)
+
+    def iterate_occurrences(self, end_date=None):
+        for occurrence, index in self.occurrences_between(self.start_date, end_date):
+            yield occurrence
+
+    def seek(self, date):
+        """
+        Give the first ``(occurrence, index)`` on or after ``date``, or
+        ``None`` when the schedule has ended before ``date``.
+        """
+        return next(self._occurrences_between(date), None)
+
+    def count_occurrences(self, start=None, end=None):
+        """
+        Count the occurrences between ``start`` and ``end`` (both inclusive)
+        in constant time, taking ``end_date`` and ``end_after_occurrences``
+        into account. Without ``end``, this gives the number of occurrences
+        left from ``start`` on, or ``None`` when the schedule repeats
+        forever.
+        """
+        count = self._occurrence_count()
+        if end is not None and end < datetime.date.max:
+            until_end = self._count_before(end + datetime.timedelta(days=1))
+            count = until_end if count is None else min(count, until_end)
+        if count is None:
+            return None
+        before_start = self._count_before(start) if start is not None else 0
+        return max(0, count - before_start)
+
+    def to_bitmap(self, start, end):
+        """
+        Give the occurrences between ``start`` and ``end`` (both inclusive)
+        as a ``Bitmap``. Daily and weekly schedules are set a stride at a
+        time, without a date per occurrence.
+        """
+        first, last = max(start, self.start_date), self._last_date()
+        if last is None or first > min(end, last):
+            return Bitmap(start, end)
+        last = min(end, last)
+
+        if self.repeat_type not in (ScheduleRepeatType.DAILY, ScheduleRepeatType.WEEKLY):
+            return Bitmap.from_dates(start, end, (occurrence for occurrence, index in
+                                                  self._occurrences_between(first, last)))
+
+        base, low, high = start.toordinal(), first.toordinal(), last.toordinal()
+        progressions, singles = self._progressions()
+        bits = 0
+        for residue, step in progressions:
+            ordinal = low + (residue - low) % step
+            bits |= stride_bits(ordinal - base, step, (high - ordinal) // step + 1)
+        for ordinal in singles:
+            if low <= ordinal <= high:
+                bits |= 1 << (ordinal - base)
+        return Bitmap(start, end, bits)
+
+    def _index_of(self, date, count):
+        index = self._count_before(date)
+        if (count is None or index < count) and self._occurrence(index) == date:
+            return index
+        return None
+
+    def index_of(self, date):
+        """
+        Give the index of the occurrence on ``date``, or ``None`` when this
+        schedule does not occur on ``date``.
+        """
+        return self._index_of(date, self._occurrence_count())
+
+    def occurs_on(self, date):
+        """
+        Tell whether this schedule occurs on ``date``, taking ``end_date``
+        and ``end_after_occurrences`` into account.
+        """
+        return self._index_of(date, self._occurrence_count()) is not None
+
+    def occurs_on_many(self, dates):
+        """
+        Like ``occurs_on``, but for a list of dates. Gives a list of booleans
+        in the same order.
+        """
+        count = self._occurrence_count()
+        return [self._index_of(date, count) is not None for date in dates]
+
+    def _last_date(self):
+        """
+        Give the date of the last occurrence, ``datetime.date.max`` when the
+        schedule repeats forever or ``None`` when it never occurs.
+        """
+        count = self._occurrence_count()
+        if count is None:
+            return datetime.date.max
+        return self._occurrence(count - 1) if count > 0 else None
+
+    def _period_days(self):
+        """
+        The number of days after which the occurrences repeat, or ``None``
+        when the schedule does not repeat.
+        """
+        if self.repeat_type == ScheduleRepeatType.DAILY:
+            return self.repeat_every
+        if self.repeat_type == ScheduleRepeatType.WEEKLY:
+            return 7 * self.repeat_every
+        if self.repeat_type == ScheduleRepeatType.MONTHLY:
+            return lcm(self.repeat_every, GREGORIAN_CYCLE_MONTHS) // GREGORIAN_CYCLE_MONTHS * GREGORIAN_CYCLE_DAYS
+        if self.repeat_type == ScheduleRepeatType.YEARLY:
+            return lcm(self.repeat_every, 400) // 400 * GREGORIAN_CYCLE_DAYS
+        return None
+
+    def _mean_gap(self):
+        """
+        The average number of days between occurrences.
+        """
+        if self.repeat_type == ScheduleRepeatType.WEEKLY:
+            return 7.0 * self.repeat_every / count_bits(self._weekday_bits)
+        return {
+            ScheduleRepeatType.DAILY: 1.0,
+            ScheduleRepeatType.MONTHLY: GREGORIAN_CYCLE_DAYS / float(GREGORIAN_CYCLE_MONTHS),
+            ScheduleRepeatType.YEARLY: GREGORIAN_CYCLE_DAYS / 400.0,
+        }.get(self.repeat_type, float('inf')) * (self.repeat_every or 1)
+
+    def _possible_weekdays(self):
+        """
+        The weekdays on which the schedule can occur after its start date,
+        as a bitmask.
+        """
+        if self.repeat_type == ScheduleRepeatType.WEEKLY:
+            return self._weekday_bits
+        if self.repeat_type == ScheduleRepeatType.MONTHLY and self.monthly_is_based_on_weekday or \
+                self.repeat_type == ScheduleRepeatType.DAILY and self.repeat_every % 7 == 0:
+            return 1 << self.start_date.weekday()
+        return 0x7f
+
+    def _progressions(self):
+        """
+        Describe the occurrences of a daily or weekly schedule, not taking
+        the end conditions into account, as arithmetic progressions of
+        ordinals ``(residue, step)`` plus single ``ordinals``, valid from
+        ``start_date`` onwards.
+        """
+        start = self.start_date.toordinal()
+        if self.repeat_type == ScheduleRepeatType.DAILY:
+            return [(start % self.repeat_every, self.repeat_every)], []
+
+        bits = self._weekday_bits
+        step = 7 * self.repeat_every
+        first_monday = start - self.start_date.weekday()
+        progressions = [((first_monday + weekday) % step, step) for weekday in range(7) if bits & (1 << weekday)]
+        # The start date always counts as the first occurrence, even when its
+        # weekday is not selected.
+        singles = [] if bits & (1 << self.start_date.weekday()) else [start]
+        return progressions, singles
+
+    def intersect(self, other, start=None, end=None, limit=None):
+        """
+        Yield the dates on which both this schedule and ``other`` occur,
+        between ``start`` and ``end`` (both inclusive), in order, at most
+        ``limit`` of them.
+
+        The common dates are computed from the periodic structure of both
+        rules instead of expanding them: daily and weekly schedules are
+        solved with the Chinese remainder theorem, other combinations are
+        scanned along the sparser schedule for at most one common period.
+        So this ends right away when the schedules never collide, and
+        ``next(schedule.intersect(other), None)`` tells whether they do.
+        """
+        start = max(start or datetime.date.min, self.start_date, other.start_date)
+        last_dates = [self._last_date(), other._last_date()]
+        if None in last_dates:
+            return
+        end = min([end or datetime.date.max] + last_dates)
+        if start > end or limit == 0:
+            return
+
+        repeating = (ScheduleRepeatType.DAILY, ScheduleRepeatType.WEEKLY)
+        if not self._possible_weekdays() & other._possible_weekdays():
+            # Never on the same weekday, except maybe on a start date
+            occurrences = (date for date in sorted(set([self.start_date, other.start_date]))
+                           if start <= date <= end and self.occurs_on(date) and other.occurs_on(date))
+        elif self.repeat_type in repeating and other.repeat_type in repeating:
+            occurrences = self._intersect_progressions(other, start, end)
+        else:
+            occurrences = self._intersect_scan(other, start, end)
+
+        for count, occurrence in enumerate(occurrences, 1):
+            yield occurrence
+            if count == limit:
+                return
+
+    def _intersect_progressions(self, other, start, end):
+        progressions, singles = self._progressions()
+        other_progressions, other_singles = other._progressions()
+
+        first, last = start.toordinal(), end.toordinal()
+        heap = []
+        for residue, step in progressions:
+            for other_residue, other_step in other_progressions:
+                solution = crt(residue, step, other_residue, other_step)
+                if solution is not None:
+                    residue_both, step_both = solution
+                    heap.append((first + (residue_both - first) % step_both, step_both))
+        for ordinal in singles:
+            if first <= ordinal <= last and other.occurs_on(datetime.date.fromordinal(ordinal)):
+                heap.append((ordinal, 0))
+        for ordinal in other_singles:
+            if first <= ordinal <= last and self.occurs_on(datetime.date.fromordinal(ordinal)):
+                heap.append((ordinal, 0))
+        heapq.heapify(heap)
+
+        previous = None
+        while heap and heap[0][0] <= last:
+            ordinal, step = heap[0]
+            if ordinal != previous:
+                yield datetime.date.fromordinal(ordinal)
+                previous = ordinal
+            if step:
+                heapq.heapreplace(heap, (ordinal + step, step))
+            else:
+                heapq.heappop(heap)
+
+    def _intersect_scan(self, other, start, end):
+        sparse, dense = (self, other) if self._mean_gap() >= other._mean_gap() else (other, self)
+        period = None
+        if sparse._period_days() and dense._period_days():
+            period = datetime.timedelta(days=lcm(sparse._period_days(), dense._period_days()))
+
+        # From the later start date on, the common dates repeat every
+        # period, so a full period without any ends the search.
+        last_hit = start - datetime.timedelta(days=1)
+        dense_count = dense._occurrence_count()
+        for occurrence, index in sparse._occurrences_between(start, end):
+            if period is not None and occurrence - last_hit > period:
+                return
+            if dense._index_of(occurrence, dense_count) is not None:
+                last_hit = occurrence
+                yield occurrence
+
+    def __getitem__(self, item):
+        count = self._occurrence_count()
+        if isinstance(item, slice):
+            if count is not None:
+                indices = range(*item.indices(count))
+            elif item.stop is None or item.stop < 0 or (item.start or 0) < 0:
+                raise IndexError('Slicing a schedule that repeats forever needs a positive start and stop')
+            else:
+                indices = range(item.start or 0, item.stop, item.step or 1)
+            return [self._occurrence(i) for i in indices]
+
+        if item < 0:
+            if count is None:
+                raise IndexError('Negative indices are not supported on a schedule that repeats forever')
+            item += count
+        if item >= 0 and (count is None or item < count):
+            return self._occurrence(item)
+        return None
+
+    def next_date(self, date):
+        """
+        Based on this schedule, give the next valid date after ``date``.
+        It is only guaranteed that the resulting next date is valid when the
+        given ``date`` is already valid.
+        """
+        if self.repeat_type == ScheduleRepeatType.DAILY:
+            return date + datetime.timedelta(days=self.repeat_every)
+        elif self.repeat_type == ScheduleRepeatType.WEEKLY:
+            return self._weekly_date(self._weekly_position(date + datetime.timedelta(days=1)))
+        elif self.repeat_type == ScheduleRepeatType.MONTHLY:
+            return self._monthly_date(self._monthly_count_before(date + datetime.timedelta(days=1)))
+        elif self.repeat_type == ScheduleRepeatType.YEARLY:
+            try:
+                return datetime.date(date.year + self.repeat_every,
+                                     self.start_date.month,
+                                     self.start_date.day)
+            except ValueError:
+                assert self.start_date.day == 29 and self.start_date.month == 2
+                return datetime.date(date.year + self.repeat_every, 2, 28)
+
+        raise ValueError('repeat_type "%s" is not supported' % self.repeat_type)
+
+
+class ScheduleSpec(RecurrenceMixin):
+    """
+    An immutable, hashable recurrence rule with the same fields and defaults
+    as ``AbstractSchedule``.
+    """
+    __slots__ = RULE_FIELDS
+
+    def __init__(self, start_date, end_date=None, end_after_occurrences=0, repeat_type=ScheduleRepeatType.NONE,
+                 repeat_every=1, monthly_is_based_on_weekday=False, monday=False, tuesday=False, wednesday=False,
+                 thursday=False, friday=False, saturday=False, sunday=False):
+        if isinstance(start_date, datetime.datetime):
+            start_date = start_date.date()
+        values = (start_date, end_date, end_after_occurrences, repeat_type, repeat_every, monthly_is_based_on_weekday,
+                  monday, tuesday, wednesday, thursday, friday, saturday, sunday)
+        for field, value in zip(RULE_FIELDS, values):
+            object.__setattr__(self, field, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ScheduleSpec is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('ScheduleSpec is immutable')
+
+    def __reduce__(self):
+        return ScheduleSpec, self.rule_fingerprint
+
+    def __eq__(self, other):
+        if not isinstance(other, ScheduleSpec):
+            return NotImplemented
+        return self.rule_fingerprint == other.rule_fingerprint
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(self.rule_fingerprint)
+
+    def __repr__(self):
+        return 'ScheduleSpec(%s)' % ', '.join('%s=%r' % (field, getattr(self, field)) for field in RULE_FIELDS)
+
+
+def count_per_day(specs, start, end):
+    """
+    Count the occurrences of ``specs`` on every day between ``start`` and
+    ``end`` (both inclusive). Gives a list with the count of ``start + i`` at
+    index ``i``.
+
+    Daily and weekly schedules are added to a difference array per stride,
+    as ``+1`` on their first and ``-1`` after their last day in the window,
+    which are summed along the stride once at the end. Monthly and yearly
+    schedules add their occurrence in every month they repeat in, found with
+    integer arithmetic on the ordinal of its first day.
+    """
+    days = (end - start).days + 1
+    counts = [0] * max(days, 0)
+    base = start.toordinal()
+    differences = {}
+    for spec in specs:
+        first, last = max(start, spec.start_date), spec._last_date()
+        if last is None or first > min(end, last):
+            continue
+        last = min(end, last)
+
+        low, high = first.toordinal(), last.toordinal()
+        if spec.repeat_type in (ScheduleRepeatType.MONTHLY, ScheduleRepeatType.YEARLY):
+            _count_months(spec, counts, base, first, last, low, high)
+            continue
+        if spec.repeat_type not in (ScheduleRepeatType.DAILY, ScheduleRepeatType.WEEKLY):
+            for occurrence, index in spec._occurrences_between(first, last):
+                counts[occurrence.toordinal() - base] += 1
+            continue
+
+        progressions, singles = spec._progressions()
+        for residue, step in progressions:
+            ordinal = low + (residue - low) % step
+            if ordinal <= high:
+                if step not in differences:
+                    differences[step] = [0] * (days + step)
+                differences[step][ordinal - base] += 1
+                differences[step][ordinal - base + ((high - ordinal) // step + 1) * step] -= 1
+        for ordinal in singles:
+            if low <= ordinal <= high:
+                counts[ordinal - base] += 1
+
+    for step, difference in differences.items():
+        for residue in range(min(step, days)):
+            difference[residue:days:step] = itertools.accumulate(difference[residue:days:step])
+        counts = list(map(operator.add, counts, difference))
+    return counts
+
+
+def _count_months(spec, counts, base, first, last, low, high):
+    """
+    Add the occurrences of a monthly or yearly ``spec`` between ``first``
+    and ``last`` (ordinals ``low`` and ``high``) to ``counts``, which starts
+    at the ordinal ``base``.
+    """
+    start = spec.start_date
+    every = spec.repeat_every * (12 if spec.repeat_type == ScheduleRepeatType.YEARLY else 1)
+    first_month = month_index(first)
+    by_weekday = spec.repeat_type == ScheduleRepeatType.MONTHLY and spec.monthly_is_based_on_weekday
+    weekday = start.weekday()
+    last_week = start.day + 7 > calendar.monthrange(start.year, start.month)[1]
+    nth_week = (start.day - 1) // 7
+    for month in range(first_month + (month_index(start) - first_month) % every, month_index(last) + 1, every):
+        first_day, days = month_ordinals(month)
+        if by_weekday and last_week:
+            last_day = first_day + days - 1
+            ordinal = last_day - ((last_day - 1) % 7 - weekday) % 7
+        elif by_weekday:
+            ordinal = first_day + (weekday - (first_day - 1) % 7) % 7 + 7 * nth_week
+        elif spec.repeat_type == ScheduleRepeatType.YEARLY:
+            # The 29th of February falls back to the 28th in other years
+            ordinal = first_day + min(start.day, days) - 1
+        elif start.day <= days:
+            ordinal = first_day + start.day - 1
+        else:
+            # Months without the day are skipped
+            continue
+        if low <= ordinal <= high:
+            counts[ordinal - base] += 1
+
+
+def expand_rules(rows, start, end=None, ordered=False):
+    """
+    Expand rows of ``(pk,) + RULE_FIELDS`` into ``(ordinal, pk, index)``
+    tuples, where ``ordinal`` is the proleptic Gregorian ordinal of the
+    occurrence, in the order of the rows or, with ``ordered=True``, sorted by
+    date. Worker processes run this, so they only need this module, and
+    integers are much cheaper to send back than dates.
+    """
+    occurrences = [(occurrence.toordinal(), row[0], index)
+                   for row in rows
+                   for occurrence, index in ScheduleSpec(*row[1:])._occurrences_between(start, end)]
+    if ordered:
+        occurrences.sort()
+    return occurrences
@@ -0,0 +1,238 @@
+"""
+Expand occurrences inside the database with a recursive common table
+expression, so they can be joined, filtered and aggregated in SQL.
+
+A recursive CTE enumerates the days of the window, on which the rules of the
+schedules are tested with integer arithmetic on day numbers (ordinals, like
+``date.toordinal()``, where ``(ordinal - 1) % 7`` is the weekday). Monthly
+schedules by day of the month walk their months in a second recursive CTE,
+which counts the months that do not have the day to keep the index right.
+
+Only the conversions between dates and day numbers depend on the database,
+SQLite and PostgreSQL are supported.
+"""
+from __future__ import unicode_literals
+from django.db import connections
+from django.db.models import F, Func, IntegerField
+
+from .spec import ScheduleRepeatType
+
+import datetime
+
+
+class SQLiteFunctions(object):
+    def ordinal(self, date):
+        return 'CAST(julianday(%s) - 1721424.5 AS INTEGER)' % date
+
+    def date(self, ordinal):
+        return 'date(%s + 1721424.5)' % ordinal
+
+    def date_part(self, part, date):
+        return "CAST(strftime('%%%%%s', %s) AS INTEGER)" % ({'year': 'Y', 'month': 'm', 'day': 'd'}[part], date)
+
+    def make_date(self, year, month, day):
+        return "printf('%%%%04d-%%%%02d-%%%%02d', %s, %s, %s)" % (year, month, day)
+
+    def days_in_month(self, year, month):
+        return "CAST(strftime('%%%%d', %s, '+1 month', '-1 day') AS INTEGER)" % self.make_date(year, month, 1)
+
+
+class PostgreSQLFunctions(object):
+    def ordinal(self, date):
+        return "(%s - DATE '0001-01-01' + 1)" % date
+
+    def date(self, ordinal):
+        return "(DATE '0001-01-01' + (%s - 1))" % ordinal
+
+    def date_part(self, part, date):
+        return 'CAST(EXTRACT(%s FROM %s) AS INTEGER)' % (part.upper(), date)
+
+    def make_date(self, year, month, day):
+        return 'make_date(%s, %s, %s)' % (year, month, day)
+
+    def days_in_month(self, year, month):
+        return "CAST(EXTRACT(DAY FROM %s + INTERVAL '1 month' - INTERVAL '1 day') AS INTEGER)" % \
+            self.make_date(year, month, 1)
+
+
+FUNCTIONS = {
+    'sqlite': SQLiteFunctions(),
+    'postgresql': PostgreSQLFunctions(),
+}
+
+
+class Ordinal(Func):
+    """
+    The day number of a date expression, like ``date.toordinal()``.
+    """
+    output_field = IntegerField()
+
+    def as_sql(self, compiler, connection, **extra_context):
+        try:
+            functions = FUNCTIONS[connection.vendor]
+        except KeyError:
+            raise NotImplementedError('Day numbers are not supported on %s' % connection.vendor)
+        extra_context['template'] = functions.ordinal('%(expressions)s')
+        return super(Ordinal, self).as_sql(compiler, connection, **extra_context)
+
+
+def popcount(bits):
+    return '(%s)' % ' + '.join('((%s >> %d) & 1)' % (bits, weekday) for weekday in range(7))
+
+
+class SQLOccurrences(object):
+    """
+    The ``(schedule_id, date, index)`` rows of the occurrences of the
+    schedules in ``schedules_queryset`` between ``start`` and ``end`` (both
+    inclusive). ``as_sql()`` gives the query to embed it in other SQL,
+    iterating runs it.
+    """
+
+    def __init__(self, schedules_queryset, start, end):
+        self.schedules_queryset = schedules_queryset
+        self.start = start
+        self.end = end
+
+    @property
+    def connection(self):
+        return connections[self.schedules_queryset.db]
+
+    def _rules_sql(self):
+        return self.schedules_queryset.values(
+            rule_id=F('pk'),
+            rule_start=F('start_date'),
+            rule_end=F('end_date'),
+            rule_count=F('end_after_occurrences'),
+            rule_type=F('repeat_type'),
+            rule_every=F('repeat_every'),
+            rule_by_weekday=F('monthly_is_based_on_weekday'),
+            rule_mask=F('weekday_mask'),
+        ).query.sql_with_params()
+
+    def as_sql(self):
+        """
+        Give ``(sql, params)`` of a query with the columns ``schedule_id``,
+        ``date`` and ``index``.
+        """
+        try:
+            functions = FUNCTIONS[self.connection.vendor]
+        except KeyError:
+            raise NotImplementedError('Expanding occurrences in SQL is not supported on %s' % self.connection.vendor)
+
+        first, last = self.start.toordinal(), self.end.toordinal()
+        last_month = self.end.year * 12 + self.end.month - 1
+        rules_sql, rules_params = self._rules_sql()
+
+        def part(name, date):
+            return functions.date_part(name, date)
+
+        month_year, month_number = 'mi / 12', 'mi %% 12 + 1'
+        sql = '''
+WITH RECURSIVE
+days(o) AS (
+    SELECT %%s
+    UNION ALL
+    SELECT o + 1 FROM days WHERE o < %%s
+),
+calendar(o, y, m, dd, mi, dim) AS (
+    SELECT o, y, m, dd, y * 12 + m - 1, {days_in_calendar_month} FROM (
+        SELECT o, {day_year} AS y, {day_month} AS m, {day_day} AS dd FROM days
+    ) c
+),
+schedules(id, s, e, n, t, every, by_weekday, mask, sy, sm, sd) AS (
+    SELECT rule_id, {start_ordinal}, {end_ordinal}, rule_count, rule_type, rule_every,
+           rule_by_weekday, rule_mask, {start_year}, {start_month}, {start_day}
+    FROM ({rules_sql}) q
+),
+rules AS (
+    SELECT schedules.*, sy * 12 + sm - 1 AS smi, (s - 1) %% 7 AS swd, weekly.bits, {bits_count} AS pc,
+           {bits_below_start} AS below_s,
+           CASE WHEN ((weekly.bits >> ((s - 1) %% 7)) & 1) = 1 THEN 0 ELSE 1 END AS extra,
+           CASE WHEN sd + 7 > {days_in_start_month} THEN 1 ELSE 0 END AS slast
+    FROM schedules JOIN (
+        SELECT id AS bits_id, CASE WHEN mask = 0 THEN 1 << ((s - 1) %% 7) ELSE mask END AS bits FROM schedules
+    ) weekly ON weekly.bits_id = schedules.id
+),
+months(id, mi, valid, sd, every, e, n) AS (
+    SELECT id, smi, 0, sd, every, e, n FROM rules WHERE t = %%s AND by_weekday = %%s
+    UNION ALL
+    SELECT id, mi + every, valid + CASE WHEN sd <= {days_in_walked_month} THEN 1 ELSE 0 END, sd, every, e, n
+    FROM months WHERE mi + every <= %%s AND (n = 0 OR valid < n)
+),
+occurrences(schedule_id, o, "index", n) AS (
+    SELECT r.id, c.o, CASE
+        WHEN r.t = %%s THEN (c.o - r.s) / r.every
+        WHEN r.t = %%s THEN CASE WHEN c.o = r.s THEN 0 ELSE
+            ((c.o - (r.s - r.swd)) / 7 / r.every) * r.pc + {bits_below_day} - r.below_s + r.extra END
+        WHEN r.t = %%s THEN (c.mi - r.smi) / r.every
+        WHEN r.t = %%s THEN (c.y - r.sy) / r.every
+        ELSE 0 END, r.n
+    FROM rules r JOIN calendar c ON c.o >= r.s AND (r.e IS NULL OR c.o <= r.e)
+    WHERE (r.t = %%s AND c.o = r.s)
+       OR (r.t = %%s AND (c.o - r.s) %% r.every = 0)
+       OR (r.t = %%s AND (c.o = r.s OR (
+               (c.o - (r.s - r.swd)) / 7 %% r.every = 0 AND ((r.bits >> ((c.o - 1) %% 7)) & 1) = 1)))
+       OR (r.t = %%s AND r.by_weekday = %%s AND (c.o - 1) %% 7 = r.swd AND (c.mi - r.smi) %% r.every = 0 AND (
+               (r.slast = 1 AND c.dd + 7 > c.dim) OR (r.slast = 0 AND (c.dd - 1) / 7 = (r.sd - 1) / 7)))
+       OR (r.t = %%s AND (c.y - r.sy) %% r.every = 0 AND c.m = r.sm AND (
+               c.dd = r.sd OR (r.sm = 2 AND r.sd = 29 AND c.dd = 28 AND c.dim = 28)))
+    UNION ALL
+    SELECT id, {walked_ordinal}, valid, n FROM months
+    WHERE sd <= {days_in_walked_month} AND (e IS NULL OR {walked_ordinal} <= e)
+)
+SELECT schedule_id, {date} AS date, "index" FROM occurrences
+WHERE o >= %%s AND o <= %%s AND (n = 0 OR "index" < n)'''.format(
+            days_in_calendar_month=functions.days_in_month('y', 'm'),
+            day_year=part('year', functions.date('o')),
+            day_month=part('month', functions.date('o')),
+            day_day=part('day', functions.date('o')),
+            start_ordinal=functions.ordinal('rule_start'),
+            end_ordinal=functions.ordinal('rule_end'),
+            start_year=part('year', 'rule_start'),
+            start_month=part('month', 'rule_start'),
+            start_day=part('day', 'rule_start'),
+            rules_sql=rules_sql.replace('%s', '%%s'),
+            bits_count=popcount('weekly.bits'),
+            bits_below_start=popcount('(weekly.bits & ((1 << ((s - 1) %% 7)) - 1))'),
+            days_in_start_month=functions.days_in_month('sy', 'sm'),
+            days_in_walked_month=functions.days_in_month(month_year, month_number),
+            bits_below_day=popcount('(r.bits & ((1 << ((c.o - 1) %% 7)) - 1))'),
+            # make_date() raises on PostgreSQL for a day the month does not
+            # have, whatever order the conditions are evaluated in
+            walked_ordinal=functions.ordinal('CASE WHEN sd <= %s THEN %s END' % (
+                functions.days_in_month(month_year, month_number),
+                functions.make_date(month_year, month_number, 'sd'))),
+            date=functions.date('o'),
+        )
+        # The placeholders of the rules query were doubled along with the
+        # rest of the template, undo that once the template is formatted.
+        sql = sql.replace('%%s', '%s')
+        params = (
+            [first, last] + list(rules_params) +
+            [ScheduleRepeatType.MONTHLY, False, last_month] +
+            [ScheduleRepeatType.DAILY, ScheduleRepeatType.WEEKLY, ScheduleRepeatType.MONTHLY,
+             ScheduleRepeatType.YEARLY] +
+            [ScheduleRepeatType.NONE, ScheduleRepeatType.DAILY, ScheduleRepeatType.WEEKLY,
+             ScheduleRepeatType.MONTHLY, True, ScheduleRepeatType.YEARLY] +
+            [first, last]
+        )
+        return sql, params
+
+    def __iter__(self):
+        """
+        Yield ``(schedule_id, date, index)``, ordered by date and schedule.
+        """
+        sql, params = self.as_sql()
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT schedule_id, date, "index" FROM (%s) occurrences '
+                           'ORDER BY date, schedule_id' % sql, params)
+            for schedule_id, date, index in cursor:
+                if not isinstance(date, datetime.date):
+                    date = datetime.datetime.strptime(date, '%Y-%m-%d').date()
+                yield schedule_id, date, index
+
+    def count(self):
+        sql, params = self.as_sql()
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM (%s) occurrences' % sql, params)
+            return cursor.fetchone()[0]
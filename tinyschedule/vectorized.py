@@ -0,0 +1,243 @@
+"""
+Expand the occurrences of many schedules at once with NumPy.
+
+``expand(schedules, start, end)`` gives three parallel arrays: the dates of
+the occurrences as ``datetime64[D]``, the primary keys of their schedules
+and their indices. Every repeat type is expanded with array arithmetic on
+day numbers (days since 1970-01-01, a Thursday) and month numbers (months
+since January 1970), so no ``datetime.date`` is created per occurrence.
+
+NumPy is an optional dependency, it is only needed to use this module.
+"""
+from __future__ import unicode_literals
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .spec import RULE_FIELDS, ScheduleRepeatType, WeekDay, count_valid_steps
+
+import datetime
+
+
+if np is not None:
+    # The number of occurrences of schedules which do not end
+    UNLIMITED = np.int64(2 ** 62)
+
+    POPCOUNT = np.array([bin(bits).count('1') for bits in range(128)], dtype=np.int64)
+
+    # SELECT_BIT[bits, n] is the weekday of the n-th selected weekday in bits
+    SELECT_BIT = np.zeros((128, 7), dtype=np.int64)
+    for bits in range(128):
+        for n, weekday in enumerate(weekday for weekday in range(7) if bits & (1 << weekday)):
+            SELECT_BIT[bits, n] = weekday
+
+
+def _rules(schedules):
+    """
+    Give the id and the rule fields of every schedule as rows, without
+    loading model instances for a queryset. Schedules are identified by
+    their primary key, ``(id, spec)`` pairs by their id, and anything else
+    without a primary key (a ``ScheduleSpec``) by its position.
+    """
+    if hasattr(schedules, 'values_list'):
+        return list(schedules.values_list('pk', *RULE_FIELDS))
+    rows = []
+    for position, schedule in enumerate(schedules):
+        if isinstance(schedule, tuple):
+            pk, schedule = schedule
+        else:
+            pk = getattr(schedule, 'pk', position)
+        rows.append((pk,) + tuple(getattr(schedule, field) for field in RULE_FIELDS))
+    return rows
+
+
+def _day_numbers(dates):
+    return np.array(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+def _weekday(days):
+    return (days + 3) % 7
+
+
+def _month(days):
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+
+def _first_day(months):
+    return months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+
+
+def _ceil_div(a, b):
+    return -(-a // b)
+
+
+def _ranges(low, high):
+    """
+    Enumerate ``range(low[i], high[i])`` for every row ``i``. Gives the rows
+    and the values as two parallel arrays.
+    """
+    counts = np.maximum(high - low, 0)
+    rows = np.repeat(np.arange(len(counts)), counts)
+    firsts = np.repeat(np.cumsum(counts) - counts, counts)
+    return rows, low[rows] + np.arange(counts.sum()) - firsts
+
+
+def _expand_none(rules, window_start):
+    keep = (rules['start'] >= window_start) & (rules['start'] <= rules['end'])
+    return np.flatnonzero(keep), rules['start'][keep], np.zeros(keep.sum(), dtype=np.int64)
+
+
+def _expand_daily(rules, window_start):
+    start, every = rules['start'], rules['every']
+    low = np.maximum(0, _ceil_div(window_start - start, every))
+    high = np.minimum((rules['end'] - start) // every + 1, rules['count'])
+    rows, indices = _ranges(low, high)
+    return rows, start[rows] + indices * every[rows], indices
+
+
+def _weekly_position(days, first_monday, every, bits, selected):
+    weeks, weekday = np.divmod(days - first_monday, 7)
+    position = _ceil_div(weeks, every) * selected
+    return position + np.where(weeks % every == 0, POPCOUNT[bits & ((1 << weekday) - 1)], 0)
+
+
+def _expand_weekly(rules, window_start):
+    start, every, end = rules['start'], rules['every'], rules['end']
+    bits = np.where(rules['weekdays'] > 0, rules['weekdays'], 1 << _weekday(start))
+    selected = POPCOUNT[bits]
+    first_monday = start - _weekday(start)
+    start_position = _weekly_position(start, first_monday, every, bits, selected)
+    # The start date always counts as the first occurrence, even when its
+    # weekday is not selected.
+    offset = np.where(bits & (1 << _weekday(start)), 0, 1)
+
+    low = _weekly_position(np.maximum(window_start, start), first_monday, every, bits, selected)
+    high = _weekly_position(np.maximum(end + 1, start), first_monday, every, bits, selected)
+    high = np.minimum(high, rules['count'] - offset + start_position)
+    rows, positions = _ranges(low, high)
+    periods, remainders = np.divmod(positions, selected[rows])
+    days = first_monday[rows] + 7 * every[rows] * periods + SELECT_BIT[bits[rows], remainders]
+    indices = offset[rows] + positions - start_position[rows]
+
+    extra = np.flatnonzero((offset == 1) & (start >= window_start) & (start <= end))
+    return (np.concatenate([rows, extra]),
+            np.concatenate([days, start[extra]]),
+            np.concatenate([indices, np.zeros(len(extra), dtype=np.int64)]))
+
+
+def _month_steps(rules, window_start):
+    """
+    The candidate steps of monthly and yearly schedules, by month.
+    """
+    start, every = rules['start'], rules['every']
+    first_month = _month(start)
+    low = np.maximum(0, _ceil_div(_month(np.maximum(window_start, start)) - first_month, every))
+    high = (_month(np.maximum(rules['end'], start)) - first_month) // every + 1
+    high = np.where(rules['end'] < start, 0, high)
+    rows, steps = _ranges(low, high)
+    return rows, steps, first_month[rows] + steps * every[rows], low
+
+
+def _expand_monthly_by_weekday(rules, window_start):
+    start = rules['start']
+    rows, steps, months, low = _month_steps(rules, window_start)
+    weekday = _weekday(start)[rows]
+    is_last_weekday = (_month(start + 7) != _month(start))[rows]
+    nth = ((start - _first_day(_month(start))) // 7)[rows]
+
+    first = _first_day(months)
+    last = _first_day(months + 1) - 1
+    days = np.where(is_last_weekday,
+                    last - (_weekday(last) - weekday) % 7,
+                    first + (weekday - _weekday(first)) % 7 + 7 * nth)
+    keep = (days >= window_start) & (days <= rules['end'][rows]) & (steps < rules['count'][rows])
+    return rows[keep], days[keep], steps[keep]
+
+
+def _expand_monthly_by_day(rules, window_start):
+    start, every = rules['start'], rules['every']
+    day = start - _first_day(_month(start)) + 1
+    rows, steps, months, low = _month_steps(rules, window_start)
+    valid = _first_day(months + 1) - _first_day(months) >= day[rows]
+
+    # Months without the day of the start date are skipped, so the index is
+    # the number of valid months before the step.
+    base = low.copy()
+    for row in np.flatnonzero(day > 28):
+        first_month = int(_month(start[row:row + 1])[0]) + 1970 * 12
+        base[row] = count_valid_steps(first_month, int(every[row]), int(day[row]), int(low[row]))
+    before = np.cumsum(valid) - valid
+    row_starts = np.cumsum(np.bincount(rows, minlength=len(start))) - np.bincount(rows, minlength=len(start))
+    indices = base[rows] + before - before[row_starts[rows]]
+
+    days = _first_day(months) + day[rows] - 1
+    keep = valid & (days >= window_start) & (days <= rules['end'][rows]) & (indices < rules['count'][rows])
+    return rows[keep], days[keep], indices[keep]
+
+
+def _expand_yearly(rules, window_start):
+    start = rules['start']
+    rules = dict(rules, every=rules['every'] * 12)
+    rows, steps, months, low = _month_steps(rules, window_start)
+    day = (start - _first_day(_month(start)) + 1)[rows]
+
+    # The 29th of February falls back to the 28th in other years
+    days = _first_day(months) + np.minimum(day, _first_day(months + 1) - _first_day(months)) - 1
+    keep = (days >= window_start) & (days <= rules['end'][rows]) & (steps < rules['count'][rows])
+    return rows[keep], days[keep], steps[keep]
+
+
+def expand(schedules, start, end):
+    """
+    Expand the occurrences of ``schedules`` (a queryset, or an iterable of
+    schedules, of ``ScheduleSpec`` or of ``(id, spec)`` pairs) between
+    ``start`` and ``end``, both inclusive. Gives ``(dates, schedule_ids,
+    indices)``: three parallel arrays ordered by date and then by schedule
+    id. Specs without an id are identified by their position.
+    """
+    if np is None:
+        raise ImportError('tinyschedule.vectorized needs NumPy, run: pip install numpy')
+
+    columns = dict((field, []) for field in ('pk',) + RULE_FIELDS)
+    for row in _rules(schedules):
+        for field, value in zip(('pk',) + RULE_FIELDS, row):
+            columns[field].append(value)
+
+    window_start, window_end = _day_numbers([start, end])
+    repeat_type = np.array(columns['repeat_type'], dtype=object)
+    weekday_based = np.array(columns['monthly_is_based_on_weekday'], dtype=bool)
+    rules = {
+        'start': _day_numbers(columns['start_date']),
+        'end': np.minimum(window_end, _day_numbers(
+            [end_date or datetime.date.max for end_date in columns['end_date']])),
+        'count': np.array([count or UNLIMITED for count in columns['end_after_occurrences']], dtype=np.int64),
+        'every': np.array(columns['repeat_every'], dtype=np.int64),
+        'weekdays': np.zeros(len(columns['pk']), dtype=np.int64),
+    }
+    for i, (weekday_slug, weekday_name) in enumerate(WeekDay.choices):
+        rules['weekdays'] |= np.array(columns[weekday_slug], dtype=np.int64) << i
+    pks = np.array(columns['pk'], dtype=np.int64)
+
+    expanders = (
+        (repeat_type == ScheduleRepeatType.NONE, _expand_none),
+        (repeat_type == ScheduleRepeatType.DAILY, _expand_daily),
+        (repeat_type == ScheduleRepeatType.WEEKLY, _expand_weekly),
+        ((repeat_type == ScheduleRepeatType.MONTHLY) & weekday_based, _expand_monthly_by_weekday),
+        ((repeat_type == ScheduleRepeatType.MONTHLY) & ~weekday_based, _expand_monthly_by_day),
+        (repeat_type == ScheduleRepeatType.YEARLY, _expand_yearly),
+    )
+    dates, ids, indices = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    for selection, expander in expanders:
+        selection = np.flatnonzero(selection)
+        if len(selection):
+            rows, days, occurrence_indices = expander(
+                dict((key, value[selection]) for key, value in rules.items()), window_start)
+            dates.append(days)
+            ids.append(pks[selection][rows])
+            indices.append(occurrence_indices)
+
+    dates, ids, indices = np.concatenate(dates), np.concatenate(ids), np.concatenate(indices)
+    order = np.lexsort((indices, ids, dates))
+    return dates[order].astype('datetime64[D]'), ids[order], indices[order]